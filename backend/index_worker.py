@@ -0,0 +1,7 @@
+import multiprocessing as mp
+mp.set_start_method('spawn', force=True)
+
+from indexer import app, INDEX_QUEUE
+
+if __name__ == '__main__':
+    app.worker_main(argv=['worker', '--loglevel=info', '--concurrency=1', '-Q', INDEX_QUEUE, '-n', 'indexer@%h'])
@@ -0,0 +1,394 @@
+import json
+import os
+import time
+import threading
+import subprocess
+import redis
+import qdrant_client
+from celery import Celery
+from celery.signals import worker_process_init
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from llama_index.core import Settings
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+from qdrant_client.http.models import PointIdsList
+
+from utils import (
+    clone_repo, sync_repo, head_commit, diff_files, RepoTooLarge,
+    INDEX_EXTS, load_manifest, save_manifest, is_indexable, walk_indexable_files,
+    run_index_pipeline, PipelineFailed, open_embedding_cache, CachedEmbedding, build_embedding, embedding_cache_name, build_tree_index,
+    index_channel, index_task_key, index_last_event_key, index_version_key, EMBED_CACHE_STATS_KEY,
+    Histogram, ProjectStore, export_local_index, local_index_dir, remove_local_index, quantized_collection_config,
+)
+
+load_dotenv()
+
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+QDRANT_URL = os.getenv("QDRANT_URL")
+QDRANT_API = os.getenv("QDRANT_API")
+SUPABASE_URL = os.getenv("SUPABASE_URL", "")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
+
+INDEX_QUEUE = os.getenv("INDEX_QUEUE", "indexing")
+
+# Repository acquisition, 0 disables a limit
+CLONE_DEPTH = int(os.getenv("CLONE_DEPTH", "1"))
+CLONE_FILTER = os.getenv("CLONE_FILTER", "")
+CLONE_SPARSE = os.getenv("CLONE_SPARSE", "false").lower() == "true"
+CLONE_MAX_MB = int(os.getenv("CLONE_MAX_MB", "0"))
+CLONE_MAX_FILES = int(os.getenv("CLONE_MAX_FILES", "0"))
+# Lease on the per-project indexing lock, renewed every INDEX_LOCK_TTL / 3 seconds while its task runs
+INDEX_LOCK_TTL = int(os.getenv("INDEX_LOCK_TTL", "600"))
+
+# Indexing pipeline tuning
+INDEX_EMBED_BATCH = int(os.getenv("INDEX_EMBED_BATCH", "64"))
+INDEX_UPSERT_BATCH = int(os.getenv("INDEX_UPSERT_BATCH", "256"))
+INDEX_READ_WORKERS = int(os.getenv("INDEX_READ_WORKERS", "4"))
+INDEX_CHUNK_WORKERS = int(os.getenv("INDEX_CHUNK_WORKERS", "2"))
+INDEX_EMBED_WORKERS = int(os.getenv("INDEX_EMBED_WORKERS", "1"))
+INDEX_UPSERT_WORKERS = int(os.getenv("INDEX_UPSERT_WORKERS", "2"))
+INDEX_QUEUE_SIZE = int(os.getenv("INDEX_QUEUE_SIZE", "256"))
+
+# Embedding runtime, see embed_engine.build_embedding
+EMBEDDING_ENGINE = os.getenv("EMBEDDING_ENGINE", "huggingface")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "8192"))
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "cache/onnx")
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "avx2")
+
+# Storage of new collections: none, scalar (int8) or binary quantized vectors in RAM with the originals on disk
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+
+# Collections up to this many chunks are also exported as a local index for the query workers, 0 disables it
+LOCAL_INDEX_MAX_CHUNKS = int(os.getenv("LOCAL_INDEX_MAX_CHUNKS", "20000"))
+
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "cache/embeddings")
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "512"))
+
+app = Celery(
+    'indexer',
+    broker=f'redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0',
+    backend=f'redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0'
+)
+app.conf.task_routes = {'index_project': {'queue': INDEX_QUEUE}}
+
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, password=REDIS_PASSWORD)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+projects = ProjectStore(supabase)
+
+# Kept in Redis so the backend's /metrics can export them
+index_queue_wait_seconds = Histogram("codevec_index_queue_wait_seconds", "Time between enqueueing an indexing task and a worker starting it", redis_client=redis_client)
+index_stage_seconds = Histogram("codevec_index_stage_seconds", "Busy time per indexing stage and run", redis_client=redis_client)
+index_seconds = Histogram("codevec_index_duration_seconds", "Indexing task run time by outcome", redis_client=redis_client)
+
+embedding_cache = None
+embedding_dim = None
+
+
+@worker_process_init.connect
+def init_worker(**kwargs):
+    """
+    Loads the embedding model once per indexing worker process
+    """
+    global embedding_cache, embedding_dim
+
+    embedding_cache = open_embedding_cache(
+        EMBED_CACHE_DIR,
+        embedding_cache_name(EMBEDDING_ENGINE, EMBEDDING_MODEL),
+        max_bytes=EMBED_CACHE_MAX_MB * 1024 * 1024,
+    )
+    if embedding_cache is None:
+        print(f"Embedding cache in {EMBED_CACHE_DIR} is used by another process, indexing without it")
+    engine_model = build_embedding(
+        EMBEDDING_ENGINE,
+        EMBEDDING_MODEL,
+        threads=EMBEDDING_THREADS,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        batch_tokens=EMBEDDING_BATCH_TOKENS,
+        onnx_dir=EMBEDDING_ONNX_DIR,
+        quantization=EMBEDDING_QUANTIZATION,
+    )
+    Settings.embed_model = CachedEmbedding(engine_model, embedding_cache)
+    # New collections are created with an explicit vector size, which also warms the model up
+    embedding_dim = len(engine_model.get_query_embedding("dimension"))
+
+
+def make_qdrant_client():
+    return qdrant_client.QdrantClient(
+        url = QDRANT_URL,
+        port=443,
+        api_key= QDRANT_API,
+        https= True,
+        prefer_grpc=False
+    )
+
+
+def publish_local_index(project_id: str, version: str, progress):
+    """
+    Mirrors a small collection into codebase/{project_id}.vectors, which the query workers search in process.
+    Larger collections only live in Qdrant, any failure leaves the workers on Qdrant as well.
+    """
+    base_dir = local_index_dir("codebase", project_id)
+    try:
+        client = make_qdrant_client()
+        count = client.count(collection_name=project_id, exact=True).count
+        if not LOCAL_INDEX_MAX_CHUNKS or count > LOCAL_INDEX_MAX_CHUNKS:
+            remove_local_index(base_dir)
+            return
+        with index_stage_seconds.time(stage="local_index"):
+            exported = export_local_index(client, project_id, base_dir, version)
+        progress("local_index", f"Exported {exported} chunks to the local index", chunks=exported)
+    except Exception as e:
+        print(f"Failed to export the local index of {project_id}: {e}")
+        remove_local_index(base_dir)
+
+
+def commit_manifest(client, project_id: str, manifest: dict, indexed: dict, removed=(), partial=None, commit=None) -> int:
+    """Deletes the points of re-indexed and removed files, records the new ones and saves the manifest.
+    Files in `partial` only got some of their points upserted: they keep their old points plus the new
+    ones and lose their hash, so the next run re-indexes them and deletes all of those points.
+
+    Return: --  int : The number of stale points deleted.
+    """
+    stale_points = [
+        point_id
+        for rel_path in set(removed) | set(indexed)
+        for point_id in manifest["files"].get(rel_path, {}).get("points", [])
+    ]
+    if stale_points:
+        client.delete(
+            collection_name=project_id,
+            points_selector=PointIdsList(points=stale_points),
+        )
+    for rel_path in removed:
+        manifest["files"].pop(rel_path, None)
+    manifest["files"].update(indexed)
+    for rel_path, points in (partial or {}).items():
+        previous = manifest["files"].get(rel_path, {}).get("points", [])
+        manifest["files"][rel_path] = {"hash": None, "points": previous + points}
+    if commit is not None:
+        manifest["commit"] = commit
+    save_manifest(project_id, manifest)
+    return len(stale_points)
+
+
+# Renews the lock while this task owns it, or takes it back if it expired (e.g. while the task was queued)
+RENEW_LOCK_SCRIPT = redis_client.register_script("""
+local owner = redis.call('get', KEYS[1])
+if owner == false or owner == ARGV[1] then
+    return redis.call('set', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+return false
+""")
+
+
+def hold_index_lock(project_id: str, task_id: str, stop: threading.Event):
+    """
+    Keeps the project's indexing lock alive until stop is set, so a long clone or sync that
+    reports no progress is not mistaken for a dead task.
+    """
+    while True:
+        try:
+            if not RENEW_LOCK_SCRIPT(keys=[index_task_key(project_id)], args=[task_id, INDEX_LOCK_TTL]):
+                print(f"Indexing lock of {project_id} is held by another task")
+        except redis.RedisError as e:
+            print(f"Failed to renew the indexing lock of {project_id}: {e}")
+        if stop.wait(INDEX_LOCK_TTL / 3):
+            return
+
+
+def publish_progress(project_id: str, event: dict):
+    payload = json.dumps({**event, "timestamp": time.time()})
+    pipe = redis_client.pipeline()
+    pipe.set(index_last_event_key(project_id), payload, ex=INDEX_LOCK_TTL)
+    pipe.publish(index_channel(project_id), payload)
+    pipe.execute()
+
+
+def init_project(project_id, resync=True, progress=None):
+    """Fetches the files from the github repo and initializes the vector store, stroes it in the qdrant database.
+    With resync, an existing checkout is fetched instead of re-cloned and only the files changed
+    since the last indexed commit are re-embedded.
+
+    Keyword arguments:
+    argument -- project_id : str : The project id of the project to be initialized.
+    argument -- resync : bool : Reuse the existing checkout and manifest when possible.
+    argument -- progress : callable : progress(stage, message, **fields) receives indexing progress.
+    Return: --  int : The number of points written or deleted, 0 when the collection is unchanged.
+    The error that stopped indexing is raised.
+    """
+    if progress is None:
+        progress = lambda stage, message, **fields: None
+
+    try:
+        save_dir = f"codebase/{project_id}"
+        client = make_qdrant_client()
+
+        manifest = load_manifest(project_id)
+        if not client.collection_exists(project_id):
+            # The manifest is only meaningful while its points still exist
+            manifest = {"commit": None, "files": {}}
+        synced = None
+        if resync and manifest["commit"] and head_commit(save_dir):
+            synced = sync_repo(save_dir, depth=CLONE_DEPTH)
+
+        if synced:
+            _, new_commit = synced
+            try:
+                changed, removed = diff_files(save_dir, manifest["commit"], new_commit)
+            except subprocess.CalledProcessError:
+                # The indexed commit is no longer in a shallow history, hashes still skip unchanged files
+                changed = set(walk_indexable_files(save_dir))
+                removed = set(manifest["files"]) - changed
+            candidates = []
+            for rel_path in sorted(changed):
+                if is_indexable(rel_path) and os.path.isfile(os.path.join(save_dir, rel_path)):
+                    candidates.append(rel_path)
+                elif rel_path in manifest["files"]:
+                    removed.add(rel_path)
+            progress("clone", "Repository synced", commit=new_commit, changed_files=len(changed))
+        else:
+            github_base_url = projects.base_git_url(project_id)
+            if not github_base_url:
+                raise Exception(f"Project {project_id} not found")
+            try:
+                clone_stats = clone_repo(
+                    repo_base = github_base_url,
+                    save_dir = save_dir,
+                    depth = CLONE_DEPTH,
+                    blob_filter = CLONE_FILTER,
+                    sparse_exts = INDEX_EXTS if CLONE_SPARSE else None,
+                    max_bytes = CLONE_MAX_MB * 1024 * 1024,
+                    max_files = CLONE_MAX_FILES,
+                )
+            except RepoTooLarge as e:
+                progress("clone", f"Repository rejected: {e}")
+                raise
+            if not clone_stats:
+                raise Exception("Failed to clone repo")
+            new_commit = head_commit(save_dir)
+            candidates = walk_indexable_files(save_dir)
+            removed = {
+                rel_path for rel_path in manifest["files"]
+                if not os.path.isfile(os.path.join(save_dir, rel_path))
+            }
+            progress("clone", "Repository cloned", commit=new_commit, **clone_stats)
+            index_stage_seconds.observe(clone_stats["seconds"], stage="clone")
+
+        build_tree_index(project_id)
+
+        # Skip files whose content did not actually change (mode changes, reverts, re-clones)
+        def should_index(rel_path, digest):
+            entry = manifest["files"].get(rel_path)
+            return not entry or entry["hash"] != digest
+
+        def report(stats):
+            progress(
+                "embed",
+                f"Embedded {stats.chunks}/{stats.chunks_total} chunks",
+                files_scanned=stats.files_scanned,
+                files_indexed=stats.files_indexed,
+                chunks_embedded=stats.chunks,
+                chunks_total=stats.chunks_total,
+                upserts_per_sec=round(stats.points_upserted / stats.elapsed, 2),
+            )
+
+        dense_config, quantization_config = quantized_collection_config(VECTOR_QUANTIZATION, embedding_dim)
+        vector_store = QdrantVectorStore(
+            client=client,
+            collection_name=project_id,
+            dense_config=dense_config,
+            quantization_config=quantization_config,
+        )
+        try:
+            indexed, stats = run_index_pipeline(
+                save_dir,
+                candidates,
+                vector_store,
+                embed_model=Settings.embed_model,
+                node_parser=Settings.node_parser,
+                should_index=should_index,
+                embed_batch_size=INDEX_EMBED_BATCH,
+                upsert_batch_size=INDEX_UPSERT_BATCH,
+                read_workers=INDEX_READ_WORKERS,
+                chunk_workers=INDEX_CHUNK_WORKERS,
+                embed_workers=INDEX_EMBED_WORKERS,
+                upsert_workers=INDEX_UPSERT_WORKERS,
+                queue_size=INDEX_QUEUE_SIZE,
+                progress=report,
+            )
+        except PipelineFailed as e:
+            # Record what already reached Qdrant, so the next run replaces it instead of leaving orphans
+            commit_manifest(client, project_id, manifest, e.indexed, partial=e.partial)
+            raise
+
+        stale_points = commit_manifest(client, project_id, manifest, indexed, removed=removed, commit=new_commit)
+        if embedding_cache is not None:
+            embedding_cache.flush()
+        for stage, seconds in stats.stage_seconds.items():
+            index_stage_seconds.observe(seconds, stage=stage)
+        print(f"Indexed project {project_id}: {len(removed)} files removed, {stale_points} stale points deleted, {stats.as_dict()}")
+        return stats.points_upserted + stale_points
+
+    except Exception as e:
+        print(f"Error initializing project {project_id}\n{e}")
+        raise
+
+
+@app.task(bind=True, name='index_project')
+def index_project(self, project_id: str, resync: bool = True, enqueued_at: float = None):
+    """
+    Indexes a project, streaming progress events to its index channel.
+    """
+    if embedding_dim is None:
+        init_worker()
+    started = time.perf_counter()
+    if enqueued_at:
+        index_queue_wait_seconds.observe(max(time.time() - enqueued_at, 0.0))
+    done = False
+
+    def progress(stage, message, **fields):
+        publish_progress(project_id, {"status": False, "stage": stage, "message": message, **fields})
+
+    lock_released = threading.Event()
+    lock_holder = threading.Thread(target=hold_index_lock, args=(project_id, self.request.id, lock_released), name="index-lock", daemon=True)
+    lock_holder.start()
+    progress("start", "Indexing started")
+
+    try:
+        try:
+            changes = init_project(project_id, resync=resync, progress=progress)
+            done = True
+        except Exception as e:
+            publish_progress(project_id, {"status": False, "stage": "failed", "message": f"Indexing failed: {e}"})
+        if done:
+            if changes or not redis_client.exists(index_version_key(project_id)):
+                version = f"{self.request.id}:{time.time()}"
+                # Exported before the version bump, so workers that see the new version find its local index
+                publish_local_index(project_id, version, progress)
+                redis_client.set(index_version_key(project_id), version)
+            else:
+                # Same points as before: the current version, its local index and cached answers stay valid
+                progress("local_index", "Collection unchanged, keeping the current index")
+            projects.set_status(project_id, True)
+            publish_progress(project_id, {"status": True, "stage": "done", "message": "Project initialized successfully"})
+
+        return {
+            'project_id': project_id,
+            'status': 'completed' if done else 'failed',
+            'finished_at': time.time()
+        }
+    finally:
+        # Stopped before the lock is deleted, so a renewal in flight cannot take it back
+        lock_released.set()
+        lock_holder.join()
+        index_seconds.observe(time.perf_counter() - started, outcome="completed" if done else "failed")
+        if redis_client.get(index_task_key(project_id)) == self.request.id.encode():
+            redis_client.delete(index_task_key(project_id))
+        if embedding_cache is not None:
+            redis_client.set(EMBED_CACHE_STATS_KEY, json.dumps(embedding_cache.stats()))
+
@@ -1,45 +1,75 @@
-from fastapi import FastAPI, Request, Response, status , WebSocket
+from fastapi import FastAPI, Query, Request, Response, status , WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 import jwt
 from starlette.status import HTTP_429_TOO_MANY_REQUESTS
 import uvicorn
 import os
+import stat
+import json
+import time
+import uuid
+import asyncio
 import mimetypes
+import redis.asyncio as redis
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from celery import Celery
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core import Settings
-from llama_index.core import StorageContext
-import qdrant_client
 from fastapi.middleware.cors import CORSMiddleware
-from llama_index.vector_stores.qdrant import QdrantVectorStore
 
 load_dotenv()
 
 REDIS_HOST = os.getenv("REDIS_HOST")
-REDIS_PORT = os.getenv("REDIS_PORT")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
-QDRANT_URL = os.getenv("QDRANT_URL")
-QDRANT_API = os.getenv("QDRANT_API")
+REDIS_PORT = os.getenv("REDIS_PORT", "6379")
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
 SUPABASE_JWT_ISSUER = os.getenv("SUPABASE_JWT_ISSUER", "")
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
 
+INDEX_QUEUE = os.getenv("INDEX_QUEUE", "indexing")
+# Lease on the per-project indexing lock, the indexer renews it while the task runs
+INDEX_LOCK_TTL = int(os.getenv("INDEX_LOCK_TTL", "600"))
+# How often /ws/init checks that the indexing task is still alive while no event arrives
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "5"))
+INFLIGHT_TTL = int(os.getenv("INFLIGHT_TTL", "300"))
+# A running question whose task wrote nothing to its stream for this long is taken over, the task likely died
+INFLIGHT_GRACE = float(os.getenv("INFLIGHT_GRACE", "60"))
+FILE_MAX_BYTES = int(os.getenv("FILE_MAX_BYTES", str(1024 * 1024)))
+# Largest page /v1/tree returns when a limit is given
+TREE_MAX_LIMIT = int(os.getenv("TREE_MAX_LIMIT", "5000"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+PROJECT_CACHE_TTL = float(os.getenv("PROJECT_CACHE_TTL", "30"))
+MAX_PROJECTS_PER_USER = int(os.getenv("MAX_PROJECTS_PER_USER", "2"))
+# Bearer token Prometheus sends to /metrics, scraping is refused while it is unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 celery_client = Celery('client', broker=f'redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0', backend=f'redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0')
 
-Settings.embed_model = HuggingFaceEmbedding(
-    model_name=EMBEDDING_MODEL
-)
+redis_client = redis.Redis(host=REDIS_HOST, port=int(REDIS_PORT), db=0, password=REDIS_PASSWORD, decode_responses=True)
 
-from utils import clone_repo, get_file_tree
+from utils import (
+    TreeIndexCache, list_tree, resolve_project_file, file_validators, not_modified, read_file,
+    inflight_key, task_stream_key, index_channel, index_task_key, index_last_event_key,
+    EMBED_CACHE_STATS_KEY, QUERY_EMBED_CACHE_STATS_KEY,
+    Histogram, METRICS_REGISTRY_KEY, metric_key, render_shared, render_value, scrape_authorized, VerifiedTokenCache,
+    ProjectStore,
+)
 
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+projects = ProjectStore(supabase, ttl=PROJECT_CACHE_TTL)
+tree_cache = TreeIndexCache()
+# Replaces the task id of an in-flight question only if it is still the one found dead
+TAKEOVER_INFLIGHT_SCRIPT = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+return false
+""")
+token_cache = VerifiedTokenCache(SUPABASE_JWT_SECRET, issuer=SUPABASE_JWT_ISSUER, max_size=AUTH_CACHE_SIZE)
+
+enqueue_seconds = Histogram("codevec_enqueue_seconds", "Time /v1/query and /ws/init spend handing a task to Celery")
 
 app = FastAPI()
 
@@ -64,6 +94,15 @@ async def verify_token_middleware(request: Request, call_next):
     if request.url.path in ["/", "/public"]:
         return await call_next(request)
 
+    # Scraped with METRICS_TOKEN instead of a user JWT
+    if request.url.path == "/metrics":
+        if scrape_authorized(request.headers.get("Authorization"), METRICS_TOKEN):
+            return await call_next(request)
+        return JSONResponse(
+            status_code=status.HTTP_403_FORBIDDEN,
+            content={"detail": "Invalid metrics token"},
+        )
+
     token = request.headers.get("Authorization")
     
     if not token or not token.startswith("Bearer "):
@@ -75,13 +114,8 @@ async def verify_token_middleware(request: Request, call_next):
     token = token.replace("Bearer ", "")
 
     try:
-        payload = jwt.decode(
-            token,
-            SUPABASE_JWT_SECRET,
-            algorithms=["HS256"],
-            options={"verify_aud": False}
-        )
-        request.state.user = payload
+        # Verified once per token, later requests with the same token hit the cache
+        request.state.user = token_cache.verify(token)
     except jwt.PyJWTError:
         return JSONResponse(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -99,48 +133,75 @@ async def health(request: Request):
         "user": request.state.user.get("email") if hasattr(request.state, "user") else None
     }
 
-async def init_project(project_id):
-    """Fetches the files from the github repo and initializes the vector store, stroes it in the qdrant database.
-    
+@app.get("/v1/stats/embedding-cache")
+async def embedding_cache_stats(request: Request):
+    """Embedding cache stats of the indexer and of every query worker process, as each last published them."""
+    indexer = await redis_client.get(EMBED_CACHE_STATS_KEY)
+    workers = await redis_client.hgetall(QUERY_EMBED_CACHE_STATS_KEY)
+    return {
+        "indexer": json.loads(indexer) if indexer else None,
+        "query_workers": {name: json.loads(stats) for name, stats in workers.items()},
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of this API plus the histograms the Celery workers and the indexer keep in Redis.
+    The query worker and the indexer have no scrape endpoint of their own, this is where their metrics are read.
+    """
+    registry = await redis_client.hgetall(METRICS_REGISTRY_KEY)
+    hashes = {name: await redis_client.hgetall(metric_key(name)) for name in registry}
+    lines = enqueue_seconds.render() + render_shared(registry, hashes)
+    auth = token_cache.stats()
+    lines += render_value(
+        "codevec_auth_cache_total", "counter", "Verified token cache lookups by result",
+        {(("result", result),): auth[result] for result in ("hits", "misses", "expired")},
+    )
+    lines += render_value("codevec_auth_cache_evictions_total", "counter", "Verified tokens evicted to stay under AUTH_CACHE_SIZE", auth["evictions"])
+    lines += render_value("codevec_auth_cache_size", "gauge", "Verified tokens currently cached", auth["size"])
+    cached = projects.stats()
+    lines += render_value(
+        "codevec_project_cache_total", "counter", "Project metadata lookups by result",
+        {(("result", result),): cached[result] for result in ("hits", "misses")},
+    )
+    lines += render_value("codevec_project_cache_size", "gauge", "Project rows currently cached", cached["size"])
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+async def inflight_alive(key: str, running_id: str) -> bool:
+    """Whether the task answering an in-flight question still shows signs of life.
+    A task writes to its stream as soon as a worker starts it, so a task without recent entries
+    (or still unstarted INFLIGHT_GRACE seconds after it was enqueued) was lost or killed.
+    """
+    last = await redis_client.xrevrange(task_stream_key(running_id), count=1)
+    if last:
+        _, fields = last[0]
+        return fields.get("step") in ("complete", "error", "cancelled") or time.time() - float(fields.get("ts", 0)) < INFLIGHT_GRACE
+    return INFLIGHT_TTL - await redis_client.ttl(key) < INFLIGHT_GRACE
+
+async def start_indexing(project_id, resync):
+    """Enqueues an indexing task unless one is already running for the project.
+
     Keyword arguments:
-    argument -- project_id : str : The project id of the project to be initialized.
-    Return: --  bool : True if the project was initialized successfully, False otherwise.
+    argument -- project_id : str : The project to index.
+    argument -- resync : bool : Reuse the existing checkout and manifest when possible.
+    Return: --  (str, bool) : The task id and whether it was started by this call.
     """
-    
-    try:
-        response =  supabase.table('project').select('base_git_url').eq('id', project_id).execute()
-        github_base_url=(response.data[0]['base_git_url'])
-        clone_status = clone_repo( repo_base = github_base_url, save_dir = f"codebase/{project_id}" )
-        if not clone_status:
-            raise Exception("Failed to clone repo")
-        documents = SimpleDirectoryReader(
-        input_dir=f"codebase/{project_id}",
-        recursive=True,
-        exclude_hidden=True,  # optional: hides .git and other dot folders
-        required_exts=[".py", ".md", ".txt", ".tsx", ".ts", ".json", ".gitignore"],  # list of file types you want to read
-        exclude=[".git", ".vscode"]  # <-- ignore .git folder
+    task_id = str(uuid.uuid4())
+    started = await redis_client.set(index_task_key(project_id), task_id, nx=True, ex=INDEX_LOCK_TTL)
+    if not started:
+        return await redis_client.get(index_task_key(project_id)), False
+    await redis_client.delete(index_last_event_key(project_id))
+    with enqueue_seconds.time(task="index_project"):
+        await asyncio.to_thread(
+            celery_client.send_task,
+            'index_project',
+            kwargs={'project_id': project_id, 'resync': resync, 'enqueued_at': time.time()},
+            task_id=task_id,
+            queue=INDEX_QUEUE,
         )
-        
-        client = qdrant_client.QdrantClient(
-        url = QDRANT_URL,
-        port=443,
-        api_key= QDRANT_API,
-        https= True,
-        prefer_grpc=False
-        )
-        
-        vector_store = QdrantVectorStore(client=client, collection_name=project_id)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
-        
-        VectorStoreIndex.from_documents(
-            documents.load_data(),
-            storage_context=storage_context,
-        )
-        return True
+    return task_id, True
 
-    except Exception as e:
-        print(f"Error initializing project {project_id}\n{e}")
-        return False
+def is_final_event(event) -> bool:
+    return bool(event) and json.loads(event).get("stage") in ("done", "failed")
 
 @app.websocket("/ws/init")
 async def websocket_endpoint(websocket: WebSocket):
@@ -148,26 +209,53 @@ async def websocket_endpoint(websocket: WebSocket):
     
     await websocket.send_json({"status": False, "message": "Initializing project..."})
     # Access query parameters
+    pubsub = None
+    project_id = None
     try:    
         params = websocket.query_params
         project_id = params.get("project_id", None)
         if not project_id:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
-        done=await init_project(project_id)
-        if not done:
-            await websocket.send_json({"status": True, "message": "Project already present"})
-            await websocket.close()
-            return
-        else:
-            supabase.table('project').update({
-                'status': True
-            }).eq('id', project_id).execute()
-            await websocket.send_json({"status": True, "message": "Project initialized successfully"})
+        resync = params.get("resync", "true").lower() != "false"
+
+        # Subscribe before enqueueing so no progress event is missed
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(index_channel(project_id))
+        task_id, started = await start_indexing(project_id, resync)
+        print(f"Indexing {project_id} in task {task_id} ({'started' if started else 'attached'})")
+        final = False
+        if not started:
+            last_event = await redis_client.get(index_last_event_key(project_id))
+            if last_event:
+                await websocket.send_text(last_event)
+                final = is_final_event(last_event)
+
+        # Relay progress until the indexer reports a final event, or its lock is gone without one
+        while not final:
+            message = await pubsub.get_message(timeout=WS_HEARTBEAT_SECONDS)
+            if message is not None:
+                await websocket.send_text(message["data"])
+                final = is_final_event(message["data"])
+                continue
+            if await redis_client.exists(index_task_key(project_id)):
+                continue
+            # The task ended or stalled past its lease, replay its final event if it published one
+            last_event = await redis_client.get(index_last_event_key(project_id))
+            if not is_final_event(last_event):
+                last_event = json.dumps({"status": False, "stage": "failed", "message": "Indexing stopped without reporting a result", "timestamp": time.time()})
+            await websocket.send_text(last_event)
+            final = True
 
         await websocket.close()
+    except WebSocketDisconnect:
+        print(f"Client left while indexing {project_id}")
     except Exception as e:
         print(f"Error initializing project {project_id} , {e}")
+    finally:
+        if pubsub is not None:
+            await pubsub.unsubscribe()
+            await pubsub.close()
 
 @app.post("/v1/query")
 async def init_query(request: Request):
@@ -182,50 +270,133 @@ async def init_query(request: Request):
             content={"detail": "Missing question or project_id"},
         )
         
-    result = celery_client.send_task('process_task', kwargs={
-        'query': question,
-        'project_id': project_id
-    })
+    # Correlation id, carried through the task into every stream message
+    trace_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+
+    # Single flight: an identical question already being answered is joined instead of re-generated
+    key = inflight_key(project_id, question)
+    task_id = str(uuid.uuid4())
+    while not await redis_client.set(key, task_id, nx=True, ex=INFLIGHT_TTL):
+        running_id = await redis_client.get(key)
+        if not running_id:
+            continue
+        if await inflight_alive(key, running_id):
+            print(f"[{trace_id}] Attached to running task. ID:", running_id)
+            return { "message" : running_id, "attached": True }
+        if await TAKEOVER_INFLIGHT_SCRIPT(keys=[key], args=[running_id, task_id, INFLIGHT_TTL]):
+            print(f"[{trace_id}] Task {running_id} went silent, answering again")
+            break
+
+    try:
+        with enqueue_seconds.time(task="process_task"):
+            result = await asyncio.to_thread(
+                celery_client.send_task,
+                'process_task',
+                kwargs={
+                    'query': question,
+                    'project_id': project_id,
+                    'inflight_key': key,
+                    'trace_id': trace_id,
+                    'enqueued_at': time.time(),
+                },
+                task_id=task_id,
+            )
+    except Exception:
+        await redis_client.delete(key)
+        raise
 
-    print("Task sent. ID:", result.id)
+    print(f"[{trace_id}] Task sent. ID:", result.id)
 
-    return { "message" : result.id }
+    return JSONResponse(
+        content={ "message" : result.id, "attached": False, "trace_id": trace_id },
+        headers={"X-Request-ID": trace_id},
+    )
 
 @app.get("/v1/tree")
-async def get_tree(request: Request):
-    project_id= request.query_params.get("project_id")
+async def get_tree(
+    request: Request,
+    project_id: str = Query(""),
+    path: str = Query(""),
+    depth: int = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(None, ge=1, le=TREE_MAX_LIMIT),
+):
+    """Lists the checkout from its cached tree index.
+    Without `path`/`depth` the whole tree is returned as before; `path` + `depth` expand a single
+    directory, `offset`/`limit` paginate (limit at most TREE_MAX_LIMIT), and ETag/If-None-Match
+    avoid resending an unchanged tree.
+    """
     if not project_id:
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
             content={"detail": "Missing project_id"},
         )
-    base_path = f"codebase/{project_id}"
-    tree = get_file_tree(base_path=base_path)
-    return { "tree" : tree }
+
+    index = await asyncio.to_thread(tree_cache.get, project_id)
+    if index is None:
+        return JSONResponse(content={"error": "Project not found"}, status_code=404)
+
+    etag = f'"{index["version"]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    tree, total = list_tree(index, path=path, depth=depth, offset=offset, limit=limit)
+    if tree is None:
+        return JSONResponse(content={"error": "Directory not found"}, status_code=404)
+    next_offset = offset + len(tree) if offset + len(tree) < total else None
+    return JSONResponse(
+        content={ "tree" : tree, "total": total, "next_offset": next_offset },
+        headers={"ETag": etag, "Cache-Control": "no-cache"},
+    )
 
 @app.get("/v1/file")
 async def get_file(request: Request):
+    """Returns the content of a checkout file.
+    `start`/`end` (bytes) or `line_start`/`line_end` select a range, reads are capped at FILE_MAX_BYTES,
+    binaries are detected from their content and ETag/Last-Modified allow 304 responses.
+    """
     project_id = request.query_params.get("project_id")
     if not project_id:
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
             content={"detail": "Missing project_id"},
         )
-    file_path = "codebase/" + project_id + "/" + request.query_params.get("file_path")
+    file_path = resolve_project_file(project_id, request.query_params.get("file_path", ""))
 
-    if os.path.exists(file_path):
-        # Detect if file is an image or text
-        mime_type, _ = mimetypes.guess_type(file_path)
-        
-        if mime_type and mime_type.startswith("image/"):
-            return JSONResponse(content={"content": "Preview not available"})
-        
-        # Assume it's a text file
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-        return JSONResponse(content={"content": text})
-    
-    return JSONResponse(content={"error": "File not found"}, status_code=404)
+    try:
+        st = await asyncio.to_thread(os.stat, file_path) if file_path else None
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        return JSONResponse(content={"error": "File not found"}, status_code=404)
+
+    etag, last_modified = file_validators(st)
+    headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "no-cache"}
+    if not_modified(request.headers, st):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # Detect if file is an image or text
+    mime_type, _ = mimetypes.guess_type(file_path)
+    if mime_type and mime_type.startswith("image/"):
+        return JSONResponse(content={"content": "Preview not available", "binary": True}, headers=headers)
+
+    params = request.query_params
+    try:
+        result = await asyncio.to_thread(
+            read_file,
+            file_path,
+            start=params.get("start"),
+            end=params.get("end"),
+            line_start=params.get("line_start"),
+            line_end=params.get("line_end"),
+            max_bytes=FILE_MAX_BYTES,
+        )
+    except ValueError:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"detail": "Ranges must be integers"},
+        )
+    return JSONResponse(content=result, headers=headers)
 
 @app.post("/v1/new/project")
 async def newProject(request: Request):
@@ -250,23 +421,23 @@ async def newProject(request: Request):
             content={"detail": "Missing project name or githuburl"},
         )
 
-    response = supabase.table("project").select("*").eq("user_id", user_id).execute();
-
-    data = response.data
+    # Counted server side, the limit only needs the number of projects
+    if await projects.acount_for_user(user_id) >= MAX_PROJECTS_PER_USER:
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"message": f"You have already created {MAX_PROJECTS_PER_USER} projects. Drop some to create new ones"}
+        )
 
-    if(len(data)<2):
-        # create the project
-        newProject = supabase.table("project").insert({"user_id" : user_id, "name" : projectName, "base_git_url" : gitHubUrl}).execute()
-        if(newProject.data):
-            return JSONResponse(
-                status_code= status.HTTP_200_OK,
-                content= {"message": "Project created", "project" : newProject.data }
-            )
-    else:
+    created = await projects.acreate(user_id, projectName, gitHubUrl)
+    if created:
         return JSONResponse(
-        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-        content={"message": "You have already created 2 projects. Drop some to create new ones"}
+            status_code= status.HTTP_200_OK,
+            content= {"message": "Project created", "project" : created }
         )
+    return JSONResponse(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        content={"detail": "Project could not be created"},
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+"""
+Embedding engine benchmark and quality check: chunks a source tree the way the indexer does
+and embeds it with each engine of embed_engine.build_embedding, each in its own process.
+
+Per engine it reports the model load time, the bulk throughput (chunks/sec), the single query
+latency (p50/p99) and the peak RSS. Against the first engine (the reference, normally the
+"huggingface" one that produced the vectors already in Qdrant) it reports:
+  - the cosine similarity between both vectors of every chunk (mean / min)
+  - recall@k of the reference top-k chunks for a set of queries
+  - recall@k when the engine's queries search the reference vectors, i.e. the worker switched
+    engine while the collections were indexed by the old one
+
+    python tests/embedding_benchmark.py --engines huggingface,onnx,onnx-int8 --threads 4
+    python tests/embedding_benchmark.py --path ../studio --max-chunks 1000 --quantization avx512_vnni --json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_chunks(path: str, max_chunks: int, seed: int):
+    from llama_index.core import Document, Settings
+    from llama_index.core.schema import MetadataMode
+    from utils import walk_indexable_files
+
+    texts = []
+    for rel_path in sorted(walk_indexable_files(path)):
+        abs_path = os.path.join(path, rel_path)
+        with open(abs_path, "rb") as f:
+            raw = f.read()
+        document = Document(
+            text=raw.decode("utf-8", errors="ignore"),
+            metadata={"file_path": abs_path, "file_name": os.path.basename(rel_path)},
+        )
+        texts += [node.get_content(metadata_mode=MetadataMode.EMBED) for node in Settings.node_parser.get_nodes_from_documents([document])]
+    random.Random(seed).shuffle(texts)
+    return texts[:max_chunks]
+
+
+def make_queries(texts, count: int, seed: int):
+    """Short questions made of a few words of random chunks."""
+    r = random.Random(seed)
+    queries = []
+    for text in r.sample(texts, min(count, len(texts))):
+        words = text.split()
+        start = r.randrange(max(len(words) - 8, 1))
+        queries.append(" ".join(words[start:start + 8]))
+    return queries
+
+
+def run_engine(args):
+    """Child process: embed the chunks and queries with one engine, save vectors and timings."""
+    from utils import build_embedding
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    started = time.perf_counter()
+    model = build_embedding(
+        args.run_engine,
+        args.model,
+        threads=args.threads,
+        batch_size=args.batch_size,
+        batch_tokens=args.batch_tokens,
+        onnx_dir=args.onnx_dir,
+        quantization=args.quantization,
+    )
+    model.get_query_embedding("warm up")
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    texts = []
+    for i in range(0, len(corpus["texts"]), args.batch_size):
+        texts += model.get_text_embedding_batch(corpus["texts"][i:i + args.batch_size])
+    bulk_seconds = time.perf_counter() - started
+
+    latencies, queries = [], []
+    for query in corpus["queries"]:
+        started = time.perf_counter()
+        queries.append(model.get_query_embedding(query))
+        latencies.append(time.perf_counter() - started)
+
+    np.savez(args.out, texts=np.asarray(texts, dtype=np.float32), queries=np.asarray(queries, dtype=np.float32))
+    latencies.sort()
+    print(json.dumps({
+        "load_seconds": round(load_seconds, 2),
+        "chunks_per_sec": round(len(texts) / bulk_seconds, 1),
+        "query_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "query_p99_ms": round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def recall_at_k(reference_queries, reference_texts, queries, texts, k: int) -> float:
+    expected = np.argsort(-(reference_queries @ reference_texts.T), axis=1)[:, :k]
+    found = np.argsort(-(queries @ texts.T), axis=1)[:, :k]
+    return float(np.mean([len(set(e) & set(f)) / k for e, f in zip(expected, found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding engine benchmark")
+    parser.add_argument("--engines", default="huggingface,onnx,onnx-int8", help="comma separated, the first one is the reference")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+    parser.add_argument("--path", default=REPO_ROOT, help="source tree to chunk")
+    parser.add_argument("--max-chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0, help="CPU threads per engine, 0 leaves the runtime default")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--batch-tokens", type=int, default=8192)
+    parser.add_argument("--onnx-dir", default="cache/onnx")
+    parser.add_argument("--quantization", default="avx2", help="arm64, avx2, avx512 or avx512_vnni")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--run-engine", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_engine:
+        run_engine(args)
+        return
+
+    texts = load_chunks(os.path.abspath(args.path), args.max_chunks, args.seed)
+    if not texts:
+        sys.exit(f"No indexable files under {args.path}")
+    queries = make_queries(texts, args.queries, args.seed)
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+
+    results, vectors = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = os.path.join(tmp, "corpus.json")
+        with open(corpus, "w", encoding="utf-8") as f:
+            json.dump({"texts": texts, "queries": queries}, f)
+        for engine in engines:
+            out = os.path.join(tmp, f"{engine}.npz")
+            child = [a for a in sys.argv[1:] if a != "--json"]
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), *child, "--run-engine", engine, "--corpus", corpus, "--out", out],
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                sys.exit(f"Engine {engine} failed:\n{proc.stderr}")
+            results[engine] = json.loads(proc.stdout.strip().splitlines()[-1])
+            with np.load(out) as data:
+                vectors[engine] = (normalize(data["texts"]), normalize(data["queries"]))
+
+    reference_texts, reference_queries = vectors[engines[0]]
+    for engine in engines[1:]:
+        engine_texts, engine_queries = vectors[engine]
+        cosine = np.sum(reference_texts * engine_texts, axis=1)
+        results[engine].update({
+            "cosine_mean": round(float(cosine.mean()), 5),
+            "cosine_min": round(float(cosine.min()), 5),
+            f"recall@{args.k}": round(recall_at_k(reference_queries, reference_texts, engine_queries, engine_texts, args.k), 4),
+            f"recall@{args.k}_vs_reference_index": round(recall_at_k(reference_queries, reference_texts, engine_queries, reference_texts, args.k), 4),
+        })
+
+    summary = {"model": args.model, "chunks": len(texts), "queries": len(queries), "reference": engines[0], "engines": results}
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"model {args.model}, {len(texts)} chunks, {len(queries)} queries, reference {engines[0]}")
+    for engine, result in results.items():
+        print(f"\n{engine}")
+        for key, value in result.items():
+            print(f"  {key:32} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Indexing throughput benchmark: generates a synthetic repository and pushes it through the same
+walk -> read -> chunk -> embed -> upsert pipeline init_project uses, with a deterministic CPU
+stub embedder (or a local HuggingFace model) and an in-memory Qdrant collection.
+
+Reports per-stage busy time, files/sec, chunks/sec and peak RSS, for a full index and for a
+resync where only --changed percent of the files differ.
+
+    python tests/index_benchmark.py --files 2000 --mix py=5,ts=3,md=1,json=1
+    python tests/index_benchmark.py --files 500 --model all-MiniLM-L6-v2 --json
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import qdrant_client
+from llama_index.core import Settings
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+from qdrant_client.http.models import PointIdsList
+
+from utils import run_index_pipeline, walk_indexable_files
+
+WORDS = (
+    "index project query vector store client stream token cache embed chunk node file path repo "
+    "commit branch result error config value request response handler worker queue batch model"
+).split()
+
+TEMPLATES = {
+    ".py": lambda r, i: (
+        f"def {r.choice(WORDS)}_{i}({r.choice(WORDS)}, {r.choice(WORDS)}=None):\n"
+        f"    \"\"\"{' '.join(r.choices(WORDS, k=8))}\"\"\"\n"
+        f"    {r.choice(WORDS)} = {r.choice(WORDS)}.{r.choice(WORDS)}({r.randint(0, 999)})\n"
+        f"    return {r.choice(WORDS)}\n\n"
+    ),
+    ".ts": lambda r, i: (
+        f"export function {r.choice(WORDS)}{i}({r.choice(WORDS)}: string): number {{\n"
+        f"  const {r.choice(WORDS)} = {r.randint(0, 999)} // {' '.join(r.choices(WORDS, k=6))}\n"
+        f"  return {r.choice(WORDS)}.length\n}}\n\n"
+    ),
+    ".tsx": lambda r, i: (
+        f"export const {r.choice(WORDS).title()}{i} = () => (\n"
+        f"  <div className=\"{r.choice(WORDS)}\">{' '.join(r.choices(WORDS, k=6))}</div>\n)\n\n"
+    ),
+    ".md": lambda r, i: f"## {' '.join(r.choices(WORDS, k=4))}\n\n{' '.join(r.choices(WORDS, k=40))}.\n\n",
+    ".txt": lambda r, i: f"{' '.join(r.choices(WORDS, k=30))}\n",
+    ".json": lambda r, i: f"  \"{r.choice(WORDS)}_{i}\": {json.dumps(r.choices(WORDS, k=4))},\n",
+}
+
+
+class StubEmbedding(BaseEmbedding):
+    """Deterministic CPU embedder: a hash seeded random unit vector per text, with an optional per-text cost."""
+
+    _dim: int = PrivateAttr()
+    _cost: float = PrivateAttr()
+
+    def __init__(self, dim: int = 384, cost_ms: float = 0.0, **kwargs):
+        super().__init__(model_name="stub", **kwargs)
+        self._dim = dim
+        self._cost = cost_ms / 1000
+
+    def _vector(self, text: str):
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        vector = np.random.default_rng(seed).standard_normal(self._dim).astype(np.float32)
+        if self._cost:
+            time.sleep(self._cost)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _get_query_embedding(self, query: str):
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str):
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts):
+        return [self._vector(text) for text in texts]
+
+    async def _aget_query_embedding(self, query: str):
+        return self._vector(query)
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        ext, _, weight = part.partition("=")
+        weights["." + ext.strip().lstrip(".")] = float(weight or 1)
+    unknown = set(weights) - set(TEMPLATES)
+    if unknown:
+        raise SystemExit(f"No generator for {', '.join(sorted(unknown))}, pick from {', '.join(TEMPLATES)}")
+    return weights
+
+
+def generate_repo(root: str, files: int, mix: dict, avg_lines: int, seed: int, binary_pct: float):
+    """Write `files` indexable files spread over nested packages, plus binary noise that must be skipped."""
+    r = random.Random(seed)
+    exts, weights = zip(*mix.items())
+    total_bytes = 0
+    for i in range(files):
+        ext = r.choices(exts, weights)[0]
+        directory = os.path.join(root, *[f"pkg{r.randint(0, 9)}" for _ in range(r.randint(0, 3))])
+        os.makedirs(directory, exist_ok=True)
+        blocks = max(1, int(r.expovariate(1 / max(avg_lines / 4, 1))))
+        body = "".join(TEMPLATES[ext](r, j) for j in range(blocks))
+        if ext == ".json":
+            body = "{\n" + body + "  \"end\": true\n}\n"
+        with open(os.path.join(directory, f"file_{i}{ext}"), "w", encoding="utf-8") as f:
+            f.write(body)
+        total_bytes += len(body)
+        if r.random() < binary_pct / 100:
+            with open(os.path.join(directory, f"asset_{i}.png"), "wb") as f:
+                f.write(r.randbytes(4096))
+    os.makedirs(os.path.join(root, ".git"), exist_ok=True)
+    return total_bytes
+
+
+def mutate_repo(root: str, manifest_files, pct: float, seed: int) -> int:
+    r = random.Random(seed + 1)
+    changed = r.sample(sorted(manifest_files), int(len(manifest_files) * pct / 100))
+    for rel_path in changed:
+        with open(os.path.join(root, rel_path), "a", encoding="utf-8") as f:
+            f.write(f"\n{' '.join(r.choices(WORDS, k=12))}\n")
+    return len(changed)
+
+
+def run(root, manifest, client, vector_store, embed_model, args):
+    def should_index(rel_path, digest):
+        entry = manifest.get(rel_path)
+        return not entry or entry["hash"] != digest
+
+    indexed, stats = run_index_pipeline(
+        root,
+        walk_indexable_files(root),
+        vector_store,
+        embed_model=embed_model,
+        node_parser=Settings.node_parser,
+        should_index=should_index,
+        embed_batch_size=args.embed_batch,
+        upsert_batch_size=args.upsert_batch,
+        read_workers=args.read_workers,
+        chunk_workers=args.chunk_workers,
+        embed_workers=args.embed_workers,
+        upsert_workers=args.upsert_workers,
+        queue_size=args.queue_size,
+    )
+    # Same clean up as init_project: points of re-indexed files are replaced
+    started = time.perf_counter()
+    stale_points = [point_id for rel_path in indexed for point_id in manifest.get(rel_path, {}).get("points", [])]
+    if stale_points:
+        client.delete(collection_name="bench", points_selector=PointIdsList(points=stale_points))
+    delete_seconds = time.perf_counter() - started
+    manifest.update(indexed)
+    return {
+        **stats.as_dict(),
+        "stale_points_deleted": len(stale_points),
+        "delete_seconds": round(delete_seconds, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexing throughput benchmark")
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--mix", default="py=4,ts=2,tsx=1,md=2,json=1", help="ext=weight,... of the generated files")
+    parser.add_argument("--avg-lines", type=int, default=120, help="mean lines per file (exponential)")
+    parser.add_argument("--binary-pct", type=float, default=5.0, help="share of files followed by a binary asset")
+    parser.add_argument("--changed", type=float, default=5.0, help="percent of files modified before the resync run")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--model", default="", help="HuggingFace model to embed with instead of the stub")
+    parser.add_argument("--dim", type=int, default=384, help="stub embedding size")
+    parser.add_argument("--embed-cost-ms", type=float, default=0.0, help="simulated stub cost per chunk")
+    parser.add_argument("--embed-batch", type=int, default=64)
+    parser.add_argument("--upsert-batch", type=int, default=256)
+    parser.add_argument("--read-workers", type=int, default=4)
+    parser.add_argument("--chunk-workers", type=int, default=2)
+    parser.add_argument("--embed-workers", type=int, default=1)
+    parser.add_argument("--upsert-workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--keep", action="store_true", help="keep the generated repository")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    if args.model:
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        embed_model = HuggingFaceEmbedding(model_name=args.model)
+    else:
+        embed_model = StubEmbedding(dim=args.dim, cost_ms=args.embed_cost_ms)
+
+    root = tempfile.mkdtemp(prefix="index-bench-")
+    try:
+        started = time.perf_counter()
+        source_bytes = generate_repo(root, args.files, parse_mix(args.mix), args.avg_lines, args.seed, args.binary_pct)
+        generate_seconds = time.perf_counter() - started
+
+        client = qdrant_client.QdrantClient(":memory:")
+        vector_store = QdrantVectorStore(client=client, collection_name="bench")
+        manifest = {}
+        full = run(root, manifest, client, vector_store, embed_model, args)
+        changed = mutate_repo(root, manifest, args.changed, args.seed)
+        resync = run(root, manifest, client, vector_store, embed_model, args)
+        result = {
+            "files": args.files,
+            "source_mb": round(source_bytes / 1024 / 1024, 2),
+            "generate_seconds": round(generate_seconds, 3),
+            "embedder": args.model or f"stub(dim={args.dim}, cost_ms={args.embed_cost_ms})",
+            "points_in_collection": client.count("bench").count,
+            "full": full,
+            "resync": {"files_changed": changed, **resync},
+        }
+    finally:
+        if args.keep:
+            print(f"Repository kept at {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        if isinstance(value, dict):
+            print(f"{key}:")
+            for name, stat in value.items():
+                print(f"  {name:24} {stat}")
+        else:
+            print(f"{key:26} {value}")
+
+
+if __name__ == "__main__":
+    main()
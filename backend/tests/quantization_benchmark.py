@@ -0,0 +1,219 @@
+"""
+Vector quantization benchmark for project collections: memory per million chunks and recall@k
+of scalar (int8) and binary quantization with oversampling and rescoring, against the current
+float32 collections (exact search is the reference).
+
+The quantized searches are reproduced in numpy: int8 with the 0.99 quantile bounds Qdrant uses,
+binary with one sign bit per dimension, top oversampling * k candidates by the quantized score,
+then rescored with the float32 originals. With --qdrant-url the same configurations are also
+created on a real Qdrant (utils.quantized_collection_config) and searched with the worker's
+search params, which reports the server's recall and latency.
+
+    python tests/quantization_benchmark.py --chunks 50000 --dim 384 --k 5,10
+    python tests/quantization_benchmark.py --vectors vectors.npy --oversampling 1,2,3,4 --json
+    python tests/quantization_benchmark.py --qdrant-url https://xyz.cloud.qdrant.io --qdrant-api $QDRANT_API --from-collection <project_id>
+
+Synthetic vectors are drawn around random centroids, like chunks of a few hundred files.
+Real embeddings (--vectors or --from-collection) give the numbers to decide on.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from utils import VECTOR_QUANTIZATIONS, quantized_collection_config, quantized_search_params
+
+MIB = 1024 * 1024
+# Qdrant's default HNSW m, level 0 keeps 2 * m links of 4 bytes per point
+HNSW_M = 16
+
+
+def normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def synthetic_vectors(count: int, dim: int, clusters: int, rng):
+    centroids = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centroids[rng.integers(0, clusters, count)] + rng.standard_normal((count, dim)).astype(np.float32) * 0.6
+    return normalize(vectors)
+
+
+def collection_vectors(client, collection: str, limit: int):
+    vectors, offset = [], None
+    while len(vectors) < limit:
+        points, offset = client.scroll(collection_name=collection, limit=1024, offset=offset, with_vectors=True, with_payload=False)
+        for point in points:
+            vector = point.vector
+            vectors.append(vector.get("text-dense") or next(iter(vector.values())) if isinstance(vector, dict) else vector)
+        if offset is None:
+            break
+    return normalize(np.asarray(vectors[:limit], dtype=np.float32))
+
+
+def memory_per_million(quantization: str, dim: int) -> dict:
+    """Bytes per point scaled to a million chunks, payloads and the id tracker excluded."""
+    hnsw = 2 * HNSW_M * 4
+    if quantization == "none":
+        ram, disk = dim * 4 + hnsw, 0
+    elif quantization == "scalar":
+        ram, disk = dim + hnsw, dim * 4
+    else:
+        ram, disk = math.ceil(dim / 8) + hnsw, dim * 4
+    return {"ram_mib": round(ram * 1_000_000 / MIB, 1), "disk_mib": round(disk * 1_000_000 / MIB, 1)}
+
+
+def top_k(scores, k: int):
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def quantized_scores(quantization: str, vectors, queries):
+    if quantization == "scalar":
+        low, high = np.quantile(vectors, 0.005), np.quantile(vectors, 0.995)
+        scale = (high - low) / 255
+        codes = np.clip(np.round((vectors - low) / scale), 0, 255).astype(np.uint8)
+        return queries @ (codes.astype(np.float32) * scale + low).T
+    # Binary: agreement of the sign bits, dim - 2 * hamming distance
+    return np.where(queries >= 0, 1.0, -1.0).astype(np.float32) @ np.where(vectors >= 0, 1.0, -1.0).astype(np.float32).T
+
+
+def recall(found, expected) -> float:
+    return float(np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)]))
+
+
+def simulate(vectors, queries, ks, oversamplings) -> dict:
+    exact = queries @ vectors.T
+    expected = {k: top_k(exact, k) for k in ks}
+    results = {}
+    for quantization in VECTOR_QUANTIZATIONS:
+        if quantization == "none":
+            continue
+        scores = quantized_scores(quantization, vectors, queries)
+        entry = {}
+        for k in ks:
+            for oversampling in oversamplings:
+                candidates = top_k(scores, max(k, int(math.ceil(k * oversampling))))
+                rescored = np.take_along_axis(exact, candidates, axis=1)
+                found = np.take_along_axis(candidates, np.argsort(-rescored, axis=1)[:, :k], axis=1)
+                entry[f"recall@{k}_oversampling_{oversampling:g}"] = round(recall(found, expected[k]), 4)
+        results[quantization] = entry
+    return results
+
+
+def on_server(client, vectors, queries, ks, oversamplings, timeout: float) -> dict:
+    from qdrant_client.http import models as rest
+
+    exact = queries @ vectors.T
+    results = {}
+    for quantization in VECTOR_QUANTIZATIONS:
+        collection = f"bench-quant-{quantization}-{uuid.uuid4().hex[:8]}"
+        dense_config, quantization_config = quantized_collection_config(quantization, vectors.shape[1])
+        client.create_collection(collection_name=collection, vectors_config=dense_config, quantization_config=quantization_config)
+        try:
+            for start in range(0, len(vectors), 1024):
+                batch = vectors[start:start + 1024]
+                client.upsert(collection_name=collection, points=rest.Batch(ids=list(range(start, start + len(batch))), vectors=batch.tolist()), wait=True)
+            deadline = time.time() + timeout
+            while client.get_collection(collection).status != rest.CollectionStatus.GREEN and time.time() < deadline:
+                time.sleep(1)
+
+            entry = {}
+            for k in ks:
+                expected = top_k(exact, k)
+                for oversampling in (oversamplings if quantization != "none" else [1.0]):
+                    params = quantized_search_params(oversampling, rescore=True)
+                    latencies, found = [], []
+                    for query in queries:
+                        started = time.perf_counter()
+                        points = client.query_points(collection_name=collection, query=query.tolist(), limit=k, search_params=params).points
+                        latencies.append(time.perf_counter() - started)
+                        found.append([point.id for point in points])
+                    latencies.sort()
+                    suffix = f"@{k}" if quantization == "none" else f"@{k}_oversampling_{oversampling:g}"
+                    entry[f"recall{suffix}"] = round(recall(found, expected), 4)
+                    entry[f"p50_ms{suffix}"] = round(latencies[len(latencies) // 2] * 1000, 2)
+                    entry[f"p99_ms{suffix}"] = round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 2)
+            results[quantization] = entry
+        finally:
+            client.delete_collection(collection)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Qdrant vector quantization benchmark")
+    parser.add_argument("--chunks", type=int, default=50000, help="synthetic vectors, ignored with --vectors/--from-collection")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--vectors", default="", help=".npy file of real embeddings")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-noise", type=float, default=0.5, help="norm of the noise added to the chunks queries are drawn from")
+    parser.add_argument("--k", default="5,10", help="comma separated, process_task uses 5")
+    parser.add_argument("--oversampling", default="1,2,4", help="comma separated oversampling factors")
+    parser.add_argument("--qdrant-url", default="", help="also benchmark the configurations on this Qdrant")
+    parser.add_argument("--qdrant-api", default="")
+    parser.add_argument("--from-collection", default="", help="read the vectors of an existing collection from --qdrant-url")
+    parser.add_argument("--index-timeout", type=float, default=300.0, help="seconds to wait for the server to index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    ks = [int(k) for k in args.k.split(",")]
+    oversamplings = [float(o) for o in args.oversampling.split(",")]
+    client = None
+    if args.qdrant_url:
+        import qdrant_client
+
+        client = qdrant_client.QdrantClient(url=args.qdrant_url, port=443, api_key=args.qdrant_api or None, https=True, prefer_grpc=False)
+
+    if args.vectors:
+        vectors = normalize(np.load(args.vectors).astype(np.float32))
+    elif args.from_collection:
+        if client is None:
+            sys.exit("--from-collection needs --qdrant-url")
+        vectors = collection_vectors(client, args.from_collection, args.chunks)
+    else:
+        vectors = synthetic_vectors(args.chunks, args.dim, args.clusters, rng)
+    dim = vectors.shape[1]
+
+    # Questions land near existing chunks without being copies of them
+    picks = rng.integers(0, len(vectors), args.queries)
+    queries = normalize(vectors[picks] + rng.standard_normal((args.queries, dim)).astype(np.float32) * args.query_noise / math.sqrt(dim))
+
+    started = time.perf_counter()
+    result = {
+        "chunks": len(vectors),
+        "dim": dim,
+        "queries": len(queries),
+        "memory_per_million_chunks": {q: memory_per_million(q, dim) for q in VECTOR_QUANTIZATIONS},
+        "simulated": simulate(vectors, queries, ks, oversamplings),
+    }
+    if client is not None:
+        result["server"] = on_server(client, vectors, queries, ks, oversamplings, args.index_timeout)
+    result["seconds"] = round(time.perf_counter() - started, 1)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{result['chunks']} chunks, dim {dim}, {result['queries']} queries")
+    for section in ("memory_per_million_chunks", "simulated", "server"):
+        if section not in result:
+            continue
+        print(f"\n{section}")
+        for quantization, values in result[section].items():
+            print(f"  {quantization}")
+            for key, value in values.items():
+                print(f"    {key:36} {value}")
+
+
+if __name__ == "__main__":
+    main()
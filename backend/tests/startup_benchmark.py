@@ -0,0 +1,84 @@
+"""
+API startup benchmark: imports main.py in a fresh interpreter, the way a new backend replica
+starts, and reports the import time, the peak RSS and which heavy ML modules ended up loaded.
+The API must not load llama_index, numpy, torch or transformers, only the indexer does.
+
+--eager also imports the indexing helpers (utils.pipeline and codevec_common.embed_cache), which shows
+what every replica used to pay before they were loaded lazily.
+
+    python tests/startup_benchmark.py --runs 5
+    python tests/startup_benchmark.py --runs 5 --eager --json
+
+main.py connects to nothing at import time, placeholder Redis/Supabase settings are enough.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("llama_index", "qdrant_client", "numpy", "torch", "transformers", "sentence_transformers")
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+if {eager}:
+    import utils.pipeline, codevec_common.embed_cache
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "import_seconds": elapsed,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "heavy": sorted({{m.split(".")[0] for m in sys.modules}} & set({heavy})),
+}}))
+"""
+
+
+def probe(eager: bool) -> dict:
+    env = dict(os.environ)
+    env.setdefault("REDIS_HOST", "127.0.0.1")
+    env.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+    env.setdefault("SUPABASE_KEY", "startup-benchmark")
+    env.setdefault("SUPABASE_JWT_SECRET", "startup-benchmark")
+    code = PROBE.format(eager=eager, heavy=repr(HEAVY_MODULES))
+    proc = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(f"Importing main.py failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend startup benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--eager", action="store_true", help="also import the indexing helpers")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    # The first run warms the OS page cache and the .pyc files, it is not reported
+    probe(args.eager)
+    runs = [probe(args.eager) for _ in range(args.runs)]
+    seconds = [r["import_seconds"] for r in runs]
+    rss = [r["peak_rss_mb"] for r in runs]
+    result = {
+        "eager": args.eager,
+        "runs": args.runs,
+        "import_seconds_p50": round(statistics.median(seconds), 3),
+        "import_seconds_max": round(max(seconds), 3),
+        "peak_rss_mb_p50": round(statistics.median(rss), 1),
+        "modules_loaded": runs[-1]["modules"],
+        "heavy_modules_loaded": runs[-1]["heavy"],
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:28} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,48 @@
-from .fetch_github import *
\ No newline at end of file
+from .fetch_github import *
+from .manifest import *
+from .keys import *
+from .file_tree import *
+from .file_reader import *
+from .projects import *
+from codevec_common.metrics import *
+from codevec_common.auth import *
+
+import importlib
+
+# The indexing helpers pull in llama_index and numpy. The API process never embeds anything,
+# so they are only imported the first time one of these names is looked up (by the indexer).
+# Module names starting with "." are relative to this package, the others live in codevec_common.
+_LAZY_EXPORTS = {
+    "PipelineAborted": ".pipeline",
+    "PipelineFailed": ".pipeline",
+    "IndexStats": ".pipeline",
+    "run_index_pipeline": ".pipeline",
+    "EmbeddingCache": "codevec_common.embed_cache",
+    "CachedEmbedding": "codevec_common.embed_cache",
+    "open_embedding_cache": "codevec_common.embed_cache",
+    "EMBEDDING_ENGINES": "codevec_common.embed_engine",
+    "DynamicBatchEmbedding": "codevec_common.embed_engine",
+    "build_embedding": "codevec_common.embed_engine",
+    "embedding_cache_name": "codevec_common.embed_engine",
+    "LocalVectorIndex": "codevec_common.vector_index",
+    "LocalVectorStore": "codevec_common.vector_index",
+    "export_local_index": "codevec_common.vector_index",
+    "local_index_dir": "codevec_common.vector_index",
+    "remove_local_index": "codevec_common.vector_index",
+    "VECTOR_QUANTIZATIONS": "codevec_common.vector_quantization",
+    "quantized_collection_config": "codevec_common.vector_quantization",
+    "quantized_search_params": "codevec_common.vector_quantization",
+}
+
+
+def __getattr__(name):
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_EXPORTS))
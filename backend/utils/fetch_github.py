@@ -1,39 +1,169 @@
 import subprocess
 import os
+import re
+import stat
+import time
 import fnmatch
 import shutil
 
-def change_permissions(path):
-    for root, dirs, files in os.walk(path, topdown=False):
+_SIZE_UNITS = {"bytes": 1, "KiB": 1 << 10, "MiB": 1 << 20, "GiB": 1 << 30}
+_RECEIVED_RE = re.compile(r"Receiving objects:.*?, ([\d.]+) (bytes|KiB|MiB|GiB)")
+
+class RepoTooLarge(Exception):
+    pass
+
+def _force_remove(func, path, exc_info):
+    # Pack files are read only, make them writable and retry
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+def _git(save_dir: str, *args) -> str:
+    result = subprocess.run(
+        ["git", "-C", save_dir, *args],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    return result.stdout.decode("utf-8", errors="replace")
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
         for name in files:
-            os.chmod(os.path.join(root, name), 0o777)  # Make files writable
-        for name in dirs:
-            os.chmod(os.path.join(root, name), 0o777)
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
 
-def clone_repo( repo_base:str, save_dir:str):
+def _run_clone(cmd, max_bytes=0):
+    """
+        Run git clone --progress, killing it as soon as the received pack exceeds max_bytes.
+        Return: bytes received as reported by git, or None if git did not report it.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    received = None
+    tail = b""
+    stderr = []
+    for block in iter(lambda: proc.stderr.read1(4096), b""):
+        stderr.append(block)
+        lines = (tail + block).replace(b"\r", b"\n").split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            match = _RECEIVED_RE.search(line.decode("utf-8", errors="replace"))
+            if match:
+                received = int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+        if max_bytes and received and received > max_bytes:
+            proc.kill()
+            proc.wait()
+            raise RepoTooLarge(f"download exceeded {max_bytes} bytes")
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=b"".join(stderr))
+    return received
+
+def clone_repo( repo_base:str, save_dir:str, depth:int = 1, blob_filter:str = "", sparse_exts=None, max_bytes:int = 0, max_files:int = 0):
     """
         Clone repo to required directory using the github PAT token with read only access to public repos.
         save_dir = agent/user_id/project_name/
+        depth -- history depth, 0 clones the full history
+        blob_filter -- partial clone filter such as "blob:none", blobs are then fetched on checkout
+        sparse_exts -- only check out files with these extensions (or names)
+        max_bytes / max_files -- abort with RepoTooLarge past these limits, 0 disables them
+        Return: dict of clone stats (seconds, bytes_received, files, checkout_bytes), False on git failure.
     """
     try:
-        os.makedirs(save_dir, exist_ok=True)
-
-        shutil.rmtree(save_dir, ignore_errors=True) if os.path.exists(save_dir) else None
+        started = time.perf_counter()
+        if os.path.exists(save_dir):
+            shutil.rmtree(save_dir, onerror=_force_remove)
+        os.makedirs(os.path.dirname(save_dir) or ".", exist_ok=True)
 
         auth_url = f"https://github.com/{repo_base}"
         print(f"Cloning repo from: {auth_url}")
-        subprocess.run(
-            ["git", "clone", auth_url, save_dir],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        change_permissions(save_dir + "/" + ".git")
-        print(f"✅ Repo cloned to: {save_dir}")
-        return True
+        cmd = ["git", "clone", "--progress", "--no-checkout"]
+        if depth:
+            cmd += ["--depth", str(depth)]
+        if blob_filter:
+            cmd += [f"--filter={blob_filter}"]
+        received = _run_clone(cmd + [auth_url, save_dir], max_bytes=max_bytes)
+
+        # Trees are always local, so the file count is known before anything is checked out
+        paths = [p for p in _git(save_dir, "ls-tree", "-r", "-z", "--name-only", "HEAD").split("\0") if p]
+        if sparse_exts:
+            patterns = [f"*{ext}" for ext in sparse_exts]
+            _git(save_dir, "sparse-checkout", "set", "--no-cone", *patterns)
+            paths = [p for p in paths if any(fnmatch.fnmatch(os.path.basename(p), pattern) for pattern in patterns)]
+        if max_files and len(paths) > max_files:
+            raise RepoTooLarge(f"{len(paths)} files exceed the limit of {max_files}")
+
+        _git(save_dir, "checkout")
+        checkout_bytes = _dir_size(save_dir) - _dir_size(os.path.join(save_dir, ".git"))
+        if max_bytes and checkout_bytes > max_bytes:
+            raise RepoTooLarge(f"checkout of {checkout_bytes} bytes exceeds the limit of {max_bytes}")
+
+        stats = {
+            "seconds": round(time.perf_counter() - started, 3),
+            "bytes_received": received if received is not None else _dir_size(os.path.join(save_dir, ".git")),
+            "files": len(paths),
+            "checkout_bytes": checkout_bytes,
+            "depth": depth,
+            "filter": blob_filter or None,
+            "sparse": bool(sparse_exts),
+        }
+        print(f"✅ Repo cloned to: {save_dir} {stats}")
+        return stats
     except subprocess.CalledProcessError as e:
         print(f"❌ Failed to clone repo: {e}")
         return False
+    except RepoTooLarge:
+        shutil.rmtree(save_dir, onerror=_force_remove)
+        raise
+
+def head_commit(save_dir: str):
+    """Return the sha of the checked out commit, or None if save_dir is not a git checkout."""
+    if not os.path.isdir(os.path.join(save_dir, ".git")):
+        return None
+    try:
+        return _git(save_dir, "rev-parse", "HEAD").strip()
+    except subprocess.CalledProcessError:
+        return None
+
+def sync_repo(save_dir: str, depth: int = 0):
+    """
+        Fetch upstream into an existing checkout and fast forward it to the remote HEAD.
+        depth keeps shallow clones shallow, 0 fetches the full history.
+        Return: (old_commit, new_commit) or None if the sync failed.
+    """
+    try:
+        old_commit = head_commit(save_dir)
+        if old_commit is None:
+            return None
+        print(f"Syncing repo in: {save_dir}")
+        _git(save_dir, "fetch", *(["--depth", str(depth)] if depth else []), "origin", "HEAD")
+        _git(save_dir, "reset", "--hard", "FETCH_HEAD")
+        new_commit = head_commit(save_dir)
+        print(f"✅ Repo synced {old_commit[:7]} -> {new_commit[:7]}")
+        return old_commit, new_commit
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Failed to sync repo: {e}")
+        return None
+
+def diff_files(save_dir: str, old_commit: str, new_commit: str):
+    """
+        List the files touched between two commits.
+        Renames are reported as a delete plus an add.
+        Return: (changed, removed) sets of paths relative to save_dir.
+    """
+    changed, removed = set(), set()
+    if old_commit == new_commit:
+        return changed, removed
+    output = _git(save_dir, "diff", "--name-status", "--no-renames", "-z", old_commit, new_commit)
+    fields = [f for f in output.split("\0") if f]
+    for status, path in zip(fields[0::2], fields[1::2]):
+        if status.startswith("D"):
+            removed.add(path)
+        else:
+            changed.add(path)
+    return changed, removed
 
 def get_file_tree(base_path, ignore_files=None, ignore_dirs=None):
     if ignore_files is None:
@@ -0,0 +1,96 @@
+import mmap
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+SNIFF_BYTES = 8192
+
+
+def resolve_project_file(project_id: str, rel_path: str):
+    """Return the absolute path of rel_path inside the project checkout, None if it escapes it."""
+    base = os.path.realpath(f"codebase/{project_id}")
+    path = os.path.realpath(os.path.join(base, rel_path))
+    if path != base and not path.startswith(base + os.sep):
+        return None
+    return path
+
+
+def file_validators(st: os.stat_result):
+    """ETag and Last-Modified of a file, derived from its mtime and size."""
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    return etag, formatdate(st.st_mtime, usegmt=True)
+
+
+def not_modified(headers, st: os.stat_result) -> bool:
+    etag, _ = file_validators(st)
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(st.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def is_binary(sample: bytes) -> bool:
+    """Content based sniffing: NUL bytes or a sample that is not UTF-8 mark a file as binary."""
+    if b"\0" in sample:
+        return True
+    try:
+        sample.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi byte character cut by the end of the sample is fine
+        return e.start < len(sample) - 3
+    return False
+
+
+def _line_offset(mm, line: int, start: int = 0, from_line: int = 1) -> int:
+    """Byte offset where 1-based `line` starts, scanning forward from `start` (the start of `from_line`)."""
+    offset = start
+    for _ in range(line - from_line):
+        offset = mm.find(b"\n", offset)
+        if offset == -1:
+            return len(mm)
+        offset += 1
+    return offset
+
+
+def read_file(path: str, start=None, end=None, line_start=None, line_end=None, max_bytes: int = 1024 * 1024) -> dict:
+    """
+        Read part of a text file through a memory map.
+        start/end select a byte range (end exclusive), line_start/line_end a 1-based inclusive line range.
+        At most max_bytes are returned, a truncated read ends with a marker and reports next_start.
+        Return: dict with content, size, start, end, truncated, next_start and binary.
+    """
+    size = os.path.getsize(path)
+    result = {"size": size, "binary": False, "truncated": False, "next_start": None}
+    if size == 0:
+        return {**result, "content": "", "start": 0, "end": 0}
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if is_binary(mm[:SNIFF_BYTES]):
+            return {**result, "binary": True, "content": "Preview not available", "start": 0, "end": 0}
+
+        if line_start is not None or line_end is not None:
+            first = max(int(line_start or 1), 1)
+            begin = _line_offset(mm, first)
+            stop = size if line_end is None else _line_offset(mm, int(line_end) + 1, begin, first)
+        else:
+            begin = min(max(int(start or 0), 0), size)
+            stop = size if end is None else min(max(int(end), begin), size)
+
+        if stop - begin > max_bytes:
+            stop = begin + max_bytes
+            # Do not split a UTF-8 sequence
+            while stop > begin and (mm[stop] & 0xC0) == 0x80:
+                stop -= 1
+            result["truncated"] = True
+            result["next_start"] = stop
+
+        content = mm[begin:stop].decode("utf-8", errors="replace")
+
+    if result["truncated"]:
+        content += f"\n\n… [truncated: showing bytes {begin}-{stop} of {size}]"
+    return {**result, "content": content, "start": begin, "end": stop}
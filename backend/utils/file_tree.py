@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import threading
+
+from .fetch_github import get_file_tree
+
+TREE_DIR = "codebase/.trees"
+
+
+def tree_index_path(project_id: str) -> str:
+    return os.path.join(TREE_DIR, f"{project_id}.json")
+
+
+def build_tree_index(project_id: str) -> dict:
+    """
+        Walk the checkout once and persist its entries grouped by parent directory.
+        Shape: {"version": str, "dirs": {dir_path: [{"type", "name", "path"}, ...]}}, "" is the root.
+    """
+    dirs = {"": []}
+    for entry in get_file_tree(base_path=f"codebase/{project_id}"):
+        parent = os.path.dirname(entry["path"])
+        dirs.setdefault(parent, []).append(entry)
+        if entry["type"] == "directory":
+            dirs.setdefault(entry["path"], [])
+    for children in dirs.values():
+        children.sort(key=lambda e: (e["type"] != "directory", e["name"]))
+        for entry in children:
+            if entry["type"] == "directory":
+                entry["children"] = len(dirs[entry["path"]])
+
+    body = json.dumps(dirs, sort_keys=True).encode("utf-8")
+    index = {"version": hashlib.blake2b(body, digest_size=12).hexdigest(), "dirs": dirs}
+
+    os.makedirs(TREE_DIR, exist_ok=True)
+    path = tree_index_path(project_id)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+    return index
+
+
+class TreeIndexCache:
+    """Per-process cache of tree indexes, reloaded whenever the indexer rewrites one."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, project_id: str):
+        """Return the tree index of a project, building it for checkouts that predate tree indexes."""
+        path = tree_index_path(project_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            if not os.path.isdir(f"codebase/{project_id}"):
+                return None
+            index = build_tree_index(project_id)
+            mtime = os.stat(path).st_mtime_ns
+        else:
+            with self.lock:
+                cached = self.entries.get(project_id)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        with self.lock:
+            self.entries[project_id] = (mtime, index)
+        return index
+
+
+def list_tree(index: dict, path: str = "", depth=None, offset: int = 0, limit=None):
+    """
+        List the entries below path, at most depth levels deep (None for everything), breadth first.
+        Return: (entries, total) where entries is the [offset, offset + limit) page of the total entries.
+    """
+    path = path.strip("/")
+    if path not in index["dirs"]:
+        return None, 0
+    entries = []
+    level = [path]
+    current_depth = 0
+    while level and (depth is None or current_depth < depth):
+        next_level = []
+        for dir_path in level:
+            for entry in index["dirs"].get(dir_path, []):
+                entries.append(entry)
+                if entry["type"] == "directory":
+                    next_level.append(entry["path"])
+        level = next_level
+        current_depth += 1
+
+    total = len(entries)
+    offset = max(offset, 0)
+    end = total if limit is None else offset + max(limit, 0)
+    return entries[offset:end], total
@@ -0,0 +1,31 @@
+import hashlib
+
+from codevec_common.keys import EMBED_CACHE_STATS_KEY, QUERY_EMBED_CACHE_STATS_KEY, index_version_key, task_stream_key
+
+# Redis keys shared between the API process and the Celery workers
+
+
+def index_channel(project_id: str) -> str:
+    """Pub/Sub channel carrying the indexing progress of a project."""
+    return f"index:{project_id}"
+
+
+def index_task_key(project_id: str) -> str:
+    """Holds the id of the indexing task currently running for a project."""
+    return f"index:{project_id}:task"
+
+
+def index_last_event_key(project_id: str) -> str:
+    """Last progress event of a project, replayed to late subscribers."""
+    return f"index:{project_id}:last"
+
+
+def normalize_question(question: str) -> str:
+    """Lower case, collapse whitespace and drop trailing punctuation so trivially different questions coalesce."""
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+def inflight_key(project_id: str, question: str) -> str:
+    """Holds the id of the task already generating an answer to this question."""
+    digest = hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()
+    return f"inflight:{project_id}:{digest}"
@@ -0,0 +1,58 @@
+import json
+import os
+
+MANIFEST_DIR = "codebase/.manifests"
+
+# File types picked up by the indexer, hidden paths are always skipped
+INDEX_EXTS = [".py", ".md", ".txt", ".tsx", ".ts", ".json", ".gitignore"]
+
+
+def manifest_path(project_id: str) -> str:
+    return os.path.join(MANIFEST_DIR, f"{project_id}.json")
+
+
+def load_manifest(project_id: str) -> dict:
+    """
+        Load the index manifest of a project.
+        Shape: {"commit": sha | None, "files": {rel_path: {"hash": sha256, "points": [point_id, ...]}}}
+    """
+    try:
+        with open(manifest_path(project_id), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("commit", None)
+        manifest.setdefault("files", {})
+        return manifest
+    except (OSError, ValueError):
+        return {"commit": None, "files": {}}
+
+
+def save_manifest(project_id: str, manifest: dict):
+    """Atomically write the manifest so a crash never leaves a half written file."""
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    path = manifest_path(project_id)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def is_indexable(rel_path: str) -> bool:
+    parts = rel_path.replace(os.sep, "/").split("/")
+    if any(part.startswith(".") for part in parts[:-1]):
+        return False
+    name = parts[-1]
+    if name in INDEX_EXTS:
+        return True
+    if name.startswith("."):
+        return False
+    return os.path.splitext(name)[1] in INDEX_EXTS
+
+
+def walk_indexable_files(base_path: str):
+    """Lazily yield indexable file paths relative to base_path."""
+    for root, dirs, names in os.walk(base_path):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            rel_path = os.path.relpath(os.path.join(root, name), base_path)
+            if is_indexable(rel_path):
+                yield rel_path
@@ -0,0 +1,314 @@
+import hashlib
+import mimetypes
+import os
+import queue
+import threading
+import time
+
+from llama_index.core import Document
+from llama_index.core.schema import MetadataMode
+
+_DONE = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class PipelineFailed(Exception):
+    """
+        A stage failed part way. Some points may already be in the vector store:
+        indexed holds the files whose every chunk was upserted (same shape as a successful run),
+        partial maps the other files that got some of their points written to those point ids.
+    """
+
+    def __init__(self, cause, indexed, partial, stats):
+        super().__init__(str(cause))
+        self.cause = cause
+        self.indexed = indexed
+        self.partial = partial
+        self.stats = stats
+
+
+class IndexStats:
+    """Counters and per-stage busy time collected while a pipeline runs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.files_scanned = 0
+        self.files_indexed = 0
+        self.chunks_total = 0
+        self.chunks = 0
+        self.points_upserted = 0
+        self.bytes_read = 0
+        self.stage_seconds = {"walk": 0.0, "read": 0.0, "chunk": 0.0, "embed": 0.0, "upsert": 0.0}
+
+    def add(self, stage, seconds, **counters):
+        with self.lock:
+            self.stage_seconds[stage] += seconds
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    @property
+    def elapsed(self):
+        end = self.finished_at or time.perf_counter()
+        return max(end - self.started_at, 1e-9)
+
+    def as_dict(self):
+        return {
+            "files_scanned": self.files_scanned,
+            "files_indexed": self.files_indexed,
+            "chunks_total": self.chunks_total,
+            "chunks": self.chunks,
+            "points_upserted": self.points_upserted,
+            "bytes_read": self.bytes_read,
+            "seconds": round(self.elapsed, 3),
+            "files_per_sec": round(self.files_indexed / self.elapsed, 2),
+            "chunks_per_sec": round(self.chunks / self.elapsed, 2),
+            "upserts_per_sec": round(self.points_upserted / self.elapsed, 2),
+            "stage_seconds": {k: round(v, 3) for k, v in self.stage_seconds.items()},
+        }
+
+
+def _put(q, item, abort):
+    while True:
+        if abort.is_set():
+            raise PipelineAborted()
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _drain(q, abort):
+    """Yield items from q until the end marker, leaving the marker for sibling workers."""
+    while True:
+        if abort.is_set():
+            raise PipelineAborted()
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            q.put(_DONE)
+            return
+        yield item
+
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _start_stage(name, fn, in_q, out_q, workers, abort, errors):
+    """Run fn(items) on `workers` threads; out_q gets the end marker once all of them finish."""
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def run():
+        try:
+            for item in fn(_drain(in_q, abort)):
+                if out_q is not None:
+                    _put(out_q, item, abort)
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            errors.append(e)
+            abort.set()
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and out_q is not None:
+                # Same bounded put as the items, a downstream stage that aborted no longer drains out_q
+                try:
+                    _put(out_q, _DONE, abort)
+                except PipelineAborted:
+                    pass
+
+    threads = [threading.Thread(target=run, name=f"index-{name}-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def run_index_pipeline(
+    base_dir,
+    rel_paths,
+    vector_store,
+    embed_model,
+    node_parser,
+    should_index=None,
+    embed_batch_size=64,
+    upsert_batch_size=256,
+    read_workers=4,
+    chunk_workers=2,
+    embed_workers=1,
+    upsert_workers=2,
+    queue_size=256,
+    progress=None,
+    progress_interval=1.0,
+):
+    """Streams files through walk -> read -> chunk -> embed -> upsert with bounded queues between stages.
+    Only `queue_size` items per stage plus the in-flight batches are held in memory, whatever the repo size.
+
+    Keyword arguments:
+    argument -- base_dir : str : Checkout the relative paths resolve against.
+    argument -- rel_paths : iterable : Candidate files, consumed lazily.
+    argument -- vector_store : BasePydanticVectorStore : Destination of the embedded nodes.
+    argument -- should_index : callable : (rel_path, sha256) -> bool, lets unchanged files be skipped.
+    argument -- progress : callable : Called with the IndexStats every `progress_interval` seconds and once at the end.
+    Return: --  (dict, IndexStats) : rel_path -> {"hash", "points"} for every indexed file, and the run stats.
+    Raises PipelineFailed when a stage fails, with what was already upserted.
+    """
+    base_dir = os.path.abspath(base_dir)
+    abort = threading.Event()
+    errors = []
+    stats = IndexStats()
+    files = {}
+    files_lock = threading.Lock()
+    collection_lock = threading.Lock()
+    collection_ready = [False]
+
+    path_q = queue.Queue(maxsize=queue_size)
+    doc_q = queue.Queue(maxsize=queue_size)
+    node_q = queue.Queue(maxsize=queue_size)
+    upsert_q = queue.Queue(maxsize=max(2, queue_size // max(embed_batch_size, 1)))
+
+    def read(items):
+        for rel_path in items:
+            started = time.perf_counter()
+            abs_path = os.path.join(base_dir, rel_path)
+            try:
+                with open(abs_path, "rb") as f:
+                    raw = f.read()
+            except OSError as e:
+                print(f"Skipping unreadable file {rel_path}: {e}")
+                continue
+            digest = hashlib.sha256(raw).hexdigest()
+            if should_index is not None and not should_index(rel_path, digest):
+                stats.add("read", time.perf_counter() - started, files_scanned=1)
+                continue
+            document = Document(
+                text=raw.decode("utf-8", errors="ignore"),
+                metadata={
+                    "file_path": abs_path,
+                    "file_name": os.path.basename(rel_path),
+                    "file_type": mimetypes.guess_type(abs_path)[0] or "text/plain",
+                    "file_size": len(raw),
+                },
+                excluded_embed_metadata_keys=["file_type", "file_size"],
+                excluded_llm_metadata_keys=["file_type", "file_size"],
+            )
+            stats.add("read", time.perf_counter() - started, files_scanned=1, files_indexed=1, bytes_read=len(raw))
+            yield rel_path, digest, document
+
+    def chunk(items):
+        for rel_path, digest, document in items:
+            started = time.perf_counter()
+            nodes = node_parser.get_nodes_from_documents([document])
+            # A file only counts as indexed once all of its chunks are upserted
+            with files_lock:
+                files[rel_path] = {"hash": digest, "points": [], "chunks": len(nodes)}
+            stats.add("chunk", time.perf_counter() - started, chunks_total=len(nodes))
+            for node in nodes:
+                yield rel_path, node
+
+    def embed(items):
+        for batch in _batched(items, embed_batch_size):
+            started = time.perf_counter()
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for _, node in batch]
+            embeddings = embed_model.get_text_embedding_batch(texts)
+            for (_, node), embedding in zip(batch, embeddings):
+                node.embedding = embedding
+            stats.add("embed", time.perf_counter() - started, chunks=len(batch))
+            yield batch
+
+    def upsert(items):
+        pending = []
+        for batch in items:
+            pending.extend(batch)
+            if len(pending) >= upsert_batch_size:
+                write(pending)
+                pending = []
+        if pending:
+            write(pending)
+        return iter(())
+
+    def write(batch):
+        started = time.perf_counter()
+        nodes = [node for _, node in batch]
+        if collection_ready[0]:
+            vector_store.add(nodes)
+        else:
+            # The first write creates the collection, keep it single threaded
+            with collection_lock:
+                vector_store.add(nodes)
+                collection_ready[0] = True
+        with files_lock:
+            for rel_path, node in batch:
+                files[rel_path]["points"].append(node.node_id)
+        stats.add("upsert", time.perf_counter() - started, points_upserted=len(nodes))
+
+    threads = []
+    threads += _start_stage("read", read, path_q, doc_q, read_workers, abort, errors)
+    threads += _start_stage("chunk", chunk, doc_q, node_q, chunk_workers, abort, errors)
+    threads += _start_stage("embed", embed, node_q, upsert_q, embed_workers, abort, errors)
+    threads += _start_stage("upsert", upsert, upsert_q, None, upsert_workers, abort, errors)
+
+    finished = threading.Event()
+    if progress is not None:
+        def report():
+            while not finished.wait(progress_interval):
+                try:
+                    progress(stats)
+                except Exception as e:
+                    print(f"Progress callback failed: {e}")
+
+        threading.Thread(target=report, name="index-progress", daemon=True).start()
+
+    try:
+        paths = iter(rel_paths)
+        while True:
+            started = time.perf_counter()
+            rel_path = next(paths, _DONE)
+            stats.add("walk", time.perf_counter() - started)
+            if rel_path is _DONE:
+                break
+            _put(path_q, rel_path, abort)
+        _put(path_q, _DONE, abort)
+    except PipelineAborted:
+        pass
+    except BaseException:
+        abort.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+        stats.finished_at = time.perf_counter()
+        finished.set()
+
+    indexed = {
+        rel_path: {"hash": entry["hash"], "points": entry["points"]}
+        for rel_path, entry in files.items()
+        if len(entry["points"]) == entry["chunks"]
+    }
+    if errors:
+        partial = {
+            rel_path: entry["points"]
+            for rel_path, entry in files.items()
+            if entry["points"] and rel_path not in indexed
+        }
+        raise PipelineFailed(errors[0], indexed, partial, stats) from errors[0]
+    if progress is not None:
+        progress(stats)
+    return indexed, stats
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+
+# Only what the API and the indexer read, rows are small and cheap to cache
+PROJECT_COLUMNS = "id,user_id,base_git_url,status"
+
+
+class ProjectStore:
+    """
+        Data access for `project` rows on top of the synchronous Supabase client.
+        Lookups by id are cached for `ttl` seconds and dropped on every write made through the store.
+        The Celery workers call the plain methods; request handlers use the a* variants, which run
+        the same queries in a thread so a Supabase round trip never blocks the event loop.
+    """
+
+    def __init__(self, supabase, ttl: float = 30.0, max_entries: int = 10000):
+        self.supabase = supabase
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, project_id: str):
+        with self.lock:
+            self.entries.pop(project_id, None)
+
+    def get(self, project_id: str):
+        """Return {id, user_id, base_git_url, status} of a project, None if it does not exist."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(project_id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        response = self.supabase.table("project").select(PROJECT_COLUMNS).eq("id", project_id).limit(1).execute()
+        project = response.data[0] if response.data else None
+        if project is not None:
+            with self.lock:
+                if len(self.entries) >= self.max_entries:
+                    # Expired entries go first, then the oldest inserted ones
+                    for key in [k for k, (expires, _) in self.entries.items() if expires <= now]:
+                        del self.entries[key]
+                    while len(self.entries) >= self.max_entries:
+                        del self.entries[next(iter(self.entries))]
+                self.entries[project_id] = (now + self.ttl, project)
+        return project
+
+    def base_git_url(self, project_id: str):
+        project = self.get(project_id)
+        return project["base_git_url"] if project else None
+
+    def count_for_user(self, user_id: str) -> int:
+        """Counted by Postgres, no rows are transferred."""
+        response = self.supabase.table("project").select("id", count="exact", head=True).eq("user_id", user_id).execute()
+        return response.count or 0
+
+    def create(self, user_id: str, name: str, base_git_url: str):
+        response = self.supabase.table("project").insert({"user_id": user_id, "name": name, "base_git_url": base_git_url}).execute()
+        for project in response.data or []:
+            self.invalidate(project["id"])
+        return response.data
+
+    def set_status(self, project_id: str, status: bool):
+        self.supabase.table("project").update({"status": status}).eq("id", project_id).execute()
+        self.invalidate(project_id)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    async def acount_for_user(self, user_id: str) -> int:
+        return await asyncio.to_thread(self.count_for_user, user_id)
+
+    async def acreate(self, user_id: str, name: str, base_git_url: str):
+        return await asyncio.to_thread(self.create, user_id, name, base_git_url)
@@ -0,0 +1,6 @@
+"""
+Code shared by the backend, the indexer, the query worker and the streamer.
+
+Submodules are imported explicitly (codevec_common.metrics, codevec_common.embed_cache, ...):
+the streamer and the API only need the light ones, this package never imports the ML stack for them.
+"""
@@ -0,0 +1,77 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+
+class VerifiedTokenCache:
+    """
+        Bounded LRU of verified JWT claims, keyed by a digest of the token so raw tokens are not kept.
+        A token is fully verified (signature, exp, issuer when configured) on its first use only;
+        its entry then lives until the token's own exp. Tokens without exp are verified every time.
+    """
+
+    def __init__(self, secret: str, issuer: str = "", algorithms=("HS256",), max_size: int = 10000, leeway: float = 0):
+        self.secret = secret
+        self.issuer = issuer or None
+        self.algorithms = list(algorithms)
+        self.max_size = max_size
+        self.leeway = leeway
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def _decode(self, token: str) -> dict:
+        return jwt.decode(
+            token,
+            self.secret,
+            algorithms=self.algorithms,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={"verify_aud": False},
+        )
+
+    def verify(self, token: str) -> dict:
+        """Return the claims of a valid token, raise jwt.PyJWTError otherwise."""
+        key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, claims = entry
+                if now < expires_at:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(claims)
+                del self.entries[key]
+                self.expired += 1
+                raise jwt.ExpiredSignatureError("Signature has expired")
+            self.misses += 1
+
+        claims = self._decode(token)
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            with self.lock:
+                self.entries[key] = (exp + self.leeway, claims)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return dict(claims)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses + self.expired
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
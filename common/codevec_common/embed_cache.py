@@ -0,0 +1,306 @@
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+
+# Written next to every vector: the key it belongs to, a crc32 of key and vector, and when it was last used (0 = free)
+ROW_DTYPE = np.dtype([("key", "V16"), ("crc", "<u4"), ("tick", "<u8")])
+
+
+class EmbeddingCacheBusy(Exception):
+    """Another process already writes this cache directory."""
+
+
+def _crc(key: bytes, vector) -> int:
+    return zlib.crc32(vector.tobytes(), zlib.crc32(key))
+
+
+class EmbeddingCache:
+    """
+        Content addressed on-disk cache of embedding vectors for one model.
+        Vectors live in a fixed capacity memory-mapped float32 array (vectors.f32) and rows.bin keeps
+        a ROW_DTYPE row per slot. A put only writes its own slots, there is no index to rewrite:
+        the key -> slot map and the least recently used order are rebuilt from rows.bin on load.
+        A slot is only served while its key and crc match, so a slot reused or torn before a crash
+        is a miss, never another text's vector. Dirty pages are forced to disk every flush_interval
+        seconds by a background thread, and at exit.
+        A cache directory has a single writer: the process holds an flock on it and any other
+        process opening it gets EmbeddingCacheBusy. Shard n > 0 of a model lives in "<model>.<n>".
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, max_bytes: int = 512 * 1024 * 1024, flush_interval: float = 30.0, shard: int = 0):
+        self.dir = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name) + (f".{shard}" if shard else ""))
+        os.makedirs(self.dir, exist_ok=True)
+        self._lock_file = open(os.path.join(self.dir, "lock"), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise EmbeddingCacheBusy(f"Embedding cache {self.dir} is used by another process")
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        self.free = []
+        self.dim = None
+        self.capacity = 0
+        self.vectors = None
+        self.rows = None
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalid = 0
+        self._dirty = False
+        self._closed = threading.Event()
+        self._load()
+        if flush_interval > 0:
+            threading.Thread(target=self._flush_periodically, args=(flush_interval,), name="embed-cache-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.dir, "meta.json")
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.dir, "vectors.f32")
+
+    @property
+    def _rows_path(self):
+        return os.path.join(self.dir, "rows.bin")
+
+    def _load(self):
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self._open(meta["dim"], meta["capacity"], mode="r+")
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(self._meta_path):
+                print(f"Discarding unreadable embedding cache {self.dir}: {e}")
+            self.vectors = None
+            self.rows = None
+            self.dim = None
+            return
+        ticks = np.array(self.rows["tick"])
+        used = np.flatnonzero(ticks)
+        used = used[np.argsort(ticks[used], kind="stable")]
+        keys = np.ascontiguousarray(self.rows["key"][used]).tobytes()
+        for i, slot in enumerate(used.tolist()):
+            key = keys[i * 16:(i + 1) * 16]
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                # The same key twice can only come from a crash, the most recently used slot wins
+                self.rows["tick"][previous] = 0
+            self.entries[key] = slot
+        self.tick = int(ticks.max()) if len(ticks) else 0
+        self.free = np.flatnonzero(np.asarray(self.rows["tick"]) == 0)[::-1].tolist()
+
+    def _open(self, dim: int, capacity: int, mode: str):
+        os.makedirs(self.dir, exist_ok=True)
+        self.dim = dim
+        self.capacity = capacity
+        self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+        self.rows = np.memmap(self._rows_path, dtype=ROW_DTYPE, mode=mode, shape=(capacity,))
+
+    def _create(self, dim: int):
+        self._open(dim, max(1, self.max_bytes // (dim * 4)), mode="w+")
+        self.free = list(range(self.capacity - 1, -1, -1))
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "capacity": self.capacity}, f)
+        os.replace(tmp_path, self._meta_path)
+        # Left behind by the previous layout, which kept the whole key -> slot map in one file
+        try:
+            os.remove(os.path.join(self.dir, "index.json"))
+        except FileNotFoundError:
+            pass
+
+    def key(self, kind: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{kind}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+    def _release(self, key: bytes, slot: int):
+        del self.entries[key]
+        self.rows["tick"][slot] = 0
+        self.free.append(slot)
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[List[float]]]:
+        found = []
+        with self.lock:
+            for key in keys:
+                slot = self.entries.get(key)
+                if slot is None:
+                    self.misses += 1
+                    found.append(None)
+                    continue
+                vector = np.array(self.vectors[slot])
+                row = self.rows[slot]
+                if row["key"].tobytes() != key or row["crc"] != _crc(key, vector):
+                    self._release(key, slot)
+                    self.invalid += 1
+                    self.misses += 1
+                    found.append(None)
+                    continue
+                self.tick += 1
+                self.rows["tick"][slot] = self.tick
+                self.entries.move_to_end(key)
+                self.hits += 1
+                found.append(vector.tolist())
+        return found
+
+    def put_many(self, keys: List[bytes], vectors: List[List[float]]):
+        if not keys:
+            return
+        with self.lock:
+            if self._closed.is_set():
+                # The directory may already belong to another process
+                return
+            if self.vectors is None:
+                self._create(len(vectors[0]))
+            for key, vector in zip(keys, vectors):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    continue
+                if self.free:
+                    slot = self.free.pop()
+                else:
+                    _, slot = self.entries.popitem(last=False)
+                    self.evictions += 1
+                vector = np.asarray(vector, dtype=np.float32)
+                self.tick += 1
+                # Freed before the vector changes, a crash in between leaves an empty slot
+                self.rows["tick"][slot] = 0
+                self.vectors[slot] = vector
+                self.rows[slot] = (key, _crc(key, vector), self.tick)
+                self.entries[key] = slot
+                self._dirty = True
+
+    def flush(self):
+        """Force the dirty pages to disk. Puts are not blocked while it runs."""
+        with self.lock:
+            if self.vectors is None or not self._dirty:
+                return
+            self._dirty = False
+            vectors, rows = self.vectors, self.rows
+        vectors.flush()
+        rows.flush()
+
+    def _flush_periodically(self, interval: float):
+        while not self._closed.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Failed to flush embedding cache {self.dir}: {e}")
+
+    def close(self):
+        """Flush, stop the flush thread and release the directory to the next process that opens it."""
+        if self._closed.is_set():
+            return
+        self.flush()
+        with self.lock:
+            self._closed.set()
+            self.entries.clear()
+            self.free = []
+            self.vectors = None
+            self.rows = None
+            self.dim = None
+            self.capacity = 0
+        atexit.unregister(self.flush)
+        self._lock_file.close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": len(self.entries),
+                "capacity": self.capacity,
+                "bytes": len(self.entries) * (self.dim or 0) * 4,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalid": self.invalid,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def open_embedding_cache(cache_dir: str, model_name: str, max_bytes: int = 512 * 1024 * 1024, shards: int = 1) -> Optional[EmbeddingCache]:
+    """
+        Opens the first of the model's `shards` cache directories that no other process writes,
+        None once they are all taken. Prefork pools pass their concurrency so every child gets one.
+    """
+    for shard in range(shards):
+        try:
+            return EmbeddingCache(cache_dir, model_name, max_bytes=max_bytes, shard=shard)
+        except EmbeddingCacheBusy:
+            continue
+    return None
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+        Wraps an embedding model and serves repeated texts from an EmbeddingCache.
+        Without a cache (see open_embedding_cache) every text goes to the model.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: Optional[EmbeddingCache] = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: Optional[EmbeddingCache], **kwargs):
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> Optional[EmbeddingCache]:
+        return self._cache
+
+    def _cached(self, kind, texts, compute):
+        if self._cache is None:
+            return compute(texts)
+        keys = [self._cache.key(kind, text) for text in texts]
+        found = self._cache.get_many(keys)
+        missing = [i for i, vector in enumerate(found) if vector is None]
+        if missing:
+            computed = compute([texts[i] for i in missing])
+            self._cache.put_many([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                found[i] = vector
+        return found
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._cached("query", [query], lambda texts: [self._inner.get_query_embedding(texts[0])])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        # HuggingFaceEmbedding embeds a list of queries in one forward pass, others go one by one
+        if hasattr(self._inner, "_embed"):
+            return self._inner._embed(queries, prompt_name="query")
+        return [self._inner.get_query_embedding(query) for query in queries]
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        return self._cached("query", queries, self._embed_queries)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._cached("text", texts, self._inner.get_text_embedding_batch)
@@ -0,0 +1,156 @@
+import glob
+import os
+import re
+from typing import List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+# "huggingface" is the full precision torch model, "onnx" and "onnx-int8" run the same model through onnxruntime on CPU
+EMBEDDING_ENGINES = ("huggingface", "onnx", "onnx-int8")
+
+# Rough size of a token, used to budget batches without tokenizing twice
+CHARS_PER_TOKEN = 4
+
+
+def embedding_cache_name(engine: str, model_name: str) -> str:
+    """Cached vectors are only reused by the engine that produced them."""
+    return model_name if engine == "huggingface" else f"{model_name}@{engine}"
+
+
+class DynamicBatchEmbedding(BaseEmbedding):
+    """
+        Sorts texts by length and cuts them into batches of at most `batch_tokens` padded tokens,
+        so a handful of long chunks no longer pads a whole batch of short ones.
+        Wraps a HuggingFaceEmbedding, the vectors are returned in the caller's order.
+    """
+
+    batch_tokens: int = 8192
+    max_length: int = 512
+
+    _inner: BaseEmbedding = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, batch_tokens: int = 8192, **kwargs):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            batch_tokens=batch_tokens,
+            max_length=getattr(inner, "max_length", 512),
+            **kwargs,
+        )
+        self._inner = inner
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "DynamicBatchEmbedding"
+
+    def _tokens(self, text: str) -> int:
+        return min(len(text) // CHARS_PER_TOKEN + 1, self.max_length)
+
+    def _batches(self, order: List[int], texts: List[str]):
+        batch, longest = [], 0
+        for i in order:
+            tokens = self._tokens(texts[i])
+            if batch and (max(longest, tokens) * (len(batch) + 1) > self.batch_tokens or len(batch) >= self.embed_batch_size):
+                yield batch
+                batch, longest = [], 0
+            batch.append(i)
+            longest = max(longest, tokens)
+        if batch:
+            yield batch
+
+    def _embed(self, texts: List[str], prompt_name: str = None) -> List[List[float]]:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for batch in self._batches(order, texts):
+            for i, vector in zip(batch, self._inner._embed([texts[i] for i in batch], prompt_name=prompt_name)):
+                vectors[i] = vector
+        return vectors
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query], prompt_name="query")[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text], prompt_name="text")[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, prompt_name="text")
+
+
+def _onnx_session_options(threads: int):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if threads > 0:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    return options
+
+
+def _onnx_model(model_name: str, onnx_dir: str, quantization: str = None):
+    """
+        Local copy of the model exported to ONNX, plus a dynamically quantized int8 graph when
+        `quantization` is set. Built on first use, later starts load it without exporting again.
+        Returns the copy's directory and the graph's path in it.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    model_dir = os.path.join(onnx_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+    # The int8 graph is model_qint8_<arch>.onnx or model_quint8_<arch>.onnx depending on the arch
+    pattern = os.path.join(model_dir, "onnx", f"model_q*int8_{quantization}.onnx" if quantization else "model.onnx")
+    if not glob.glob(pattern):
+        print(f"Exporting {model_name} to ONNX{f' int8 ({quantization})' if quantization else ''} in {model_dir}")
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs={"provider": "CPUExecutionProvider"})
+        model.save_pretrained(model_dir)
+        if quantization:
+            export_dynamic_quantized_onnx_model(model, quantization, model_dir)
+    return model_dir, os.path.relpath(glob.glob(pattern)[0], model_dir)
+
+
+def build_embedding(
+    engine: str,
+    model_name: str,
+    threads: int = 0,
+    batch_size: int = 64,
+    batch_tokens: int = 8192,
+    onnx_dir: str = "cache/onnx",
+    quantization: str = "avx2",
+) -> BaseEmbedding:
+    """
+        Embedding model for `engine`, one of EMBEDDING_ENGINES.
+        threads caps the CPU threads used by torch or onnxruntime (0 leaves the runtime default).
+        quantization is the onnxruntime int8 config of onnx-int8: arm64, avx2, avx512 or avx512_vnni.
+    """
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    from llama_index.embeddings.huggingface.utils import (
+        get_query_instruct_for_model_name,
+        get_text_instruct_for_model_name,
+    )
+
+    if engine not in EMBEDDING_ENGINES:
+        raise ValueError(f"Unknown embedding engine {engine!r}, expected one of {', '.join(EMBEDDING_ENGINES)}")
+
+    if engine == "huggingface":
+        if threads > 0:
+            import torch
+
+            torch.set_num_threads(threads)
+        model = HuggingFaceEmbedding(model_name=model_name, embed_batch_size=batch_size)
+    else:
+        model_path, file_name = _onnx_model(model_name, onnx_dir, quantization if engine == "onnx-int8" else None)
+        model_kwargs = {"provider": "CPUExecutionProvider", "session_options": _onnx_session_options(threads), "file_name": file_name}
+        model = HuggingFaceEmbedding(
+            model_name=model_path,
+            embed_batch_size=batch_size,
+            device="cpu",
+            # Instructions are looked up by the hub name, not the local copy's path
+            query_instruction=get_query_instruct_for_model_name(model_name),
+            text_instruction=get_text_instruct_for_model_name(model_name),
+            backend="onnx",
+            model_kwargs=model_kwargs,
+        )
+        model.model_name = model_name
+    return DynamicBatchEmbedding(model, batch_tokens=batch_tokens)
@@ -0,0 +1,27 @@
+# Redis keys read and written by more than one service
+
+
+def index_version_key(project_id: str) -> str:
+    """Changes every time a project is re-indexed, workers drop cached state when it does."""
+    return f"index:{project_id}:version"
+
+
+def task_stream_key(task_id: str) -> str:
+    """Redis Stream holding every message of one task, written by the worker and read by the streamer."""
+    return f"stream:task:{task_id}"
+
+
+def cancel_key(task_id: str) -> str:
+    """Set by the streamer, with the disconnect time, once the last viewer of a task left."""
+    return f"cancel:task:{task_id}"
+
+
+def viewers_key(task_id: str) -> str:
+    """Number of websockets currently attached to a task's stream."""
+    return f"viewers:task:{task_id}"
+
+
+# JSON stats of the indexer's embedding cache, rewritten after every indexing task
+EMBED_CACHE_STATS_KEY = "stats:embedding-cache:indexer"
+# Hash of JSON stats of each query worker process's embedding cache, keyed by "<hostname>:<pid>"
+QUERY_EMBED_CACHE_STATS_KEY = "stats:embedding-cache:query-workers"
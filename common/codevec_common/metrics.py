@@ -0,0 +1,154 @@
+import bisect
+import hmac
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a fast cache hit to a slow generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+# Histograms shared through Redis register their help text and buckets here
+METRICS_REGISTRY_KEY = "metrics:registry"
+
+
+def metric_key(name: str) -> str:
+    return f"metrics:{name}"
+
+
+def scrape_authorized(authorization, token: str) -> bool:
+    """Whether a /metrics request carries `Authorization: Bearer <token>`. Without a token nobody may scrape."""
+    if not token or not authorization or not authorization.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(authorization[len("Bearer "):].encode(), token.encode())
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labels: dict) -> str:
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+
+
+def _value(v) -> str:
+    if isinstance(v, float) and v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+def _with_le(series: str, le: str) -> str:
+    return f'{series},le="{le}"' if series else f'le="{le}"'
+
+
+def render_histogram(name: str, documentation: str, buckets, series: dict) -> list:
+    """
+        Prometheus text format of a histogram.
+        series maps a label string to (per bucket counts, the last one for +Inf, sum of observations).
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} histogram"]
+    for labels, (counts, total) in sorted(series.items()):
+        cumulative = 0
+        for le, count in zip(list(buckets) + [float("inf")], counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{{{_with_le(labels, _value(float(le)))}}} {cumulative}")
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {_value(float(total))}")
+        lines.append(f"{name}_count{suffix} {cumulative}")
+    return lines
+
+
+def render_value(name: str, kind: str, documentation: str, values) -> list:
+    """Prometheus text format of a counter or gauge, values is a number or {labels dict as tuple: number}."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    if not isinstance(values, dict):
+        values = {(): values}
+    for labels, value in sorted(values.items()):
+        label_str = _label_str(dict(labels))
+        lines.append(f"{name}{{{label_str}}} {_value(value)}" if label_str else f"{name} {_value(value)}")
+    return lines
+
+
+def _decode(v):
+    return v.decode() if isinstance(v, bytes) else v
+
+
+def parse_shared_histogram(buckets, raw: dict) -> dict:
+    """Turn the Redis hash of a shared histogram back into render_histogram series."""
+    series = {}
+    for field, value in raw.items():
+        labels, _, slot = _decode(field).rpartition("\t")
+        counts, total = series.setdefault(labels, ([0] * (len(buckets) + 1), [0.0]))
+        if slot == "sum":
+            total[0] = float(value)
+        else:
+            counts[int(slot)] = int(value)
+    return {labels: (counts, total[0]) for labels, (counts, total) in series.items()}
+
+
+def render_shared(registry: dict, hashes: dict) -> list:
+    """
+        Render every histogram kept in Redis.
+        registry is the hash at METRICS_REGISTRY_KEY, hashes maps a metric name to its metric_key hash.
+    """
+    lines = []
+    for name, meta in sorted((_decode(k), json.loads(v)) for k, v in registry.items()):
+        series = parse_shared_histogram(meta["buckets"], hashes.get(name) or {})
+        lines += render_histogram(name, meta["help"], meta["buckets"], series)
+    return lines
+
+
+class Histogram:
+    """
+        Prometheus style histogram.
+        Kept in process by default. With a (sync) redis_client the buckets live in a Redis hash
+        instead, so observations from every worker process add up and another service can export them.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS, redis_client=None):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.redis = redis_client
+        self.lock = threading.Lock()
+        self.series = {}
+        self.registered = False
+
+    def _register(self):
+        self.redis.hset(METRICS_REGISTRY_KEY, self.name, json.dumps({"help": self.documentation, "buckets": self.buckets}))
+        self.registered = True
+
+    def observe(self, value: float, **labels):
+        labels_str = _label_str(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        if self.redis is not None:
+            try:
+                if not self.registered:
+                    self._register()
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.hincrby(metric_key(self.name), f"{labels_str}\t{slot}", 1)
+                pipe.hincrbyfloat(metric_key(self.name), f"{labels_str}\tsum", value)
+                pipe.execute()
+            except Exception as e:
+                print(f"Failed to record {self.name}: {e}")
+            return
+        with self.lock:
+            counts, total = self.series.setdefault(labels_str, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[slot] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list:
+        with self.lock:
+            series = {labels: (list(counts), total[0]) for labels, (counts, total) in self.series.items()}
+        return render_histogram(self.name, self.documentation, self.buckets, series)
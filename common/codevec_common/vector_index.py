@@ -0,0 +1,171 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import time
+from typing import Any, List
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+# Written last, a version directory without it is incomplete
+LOCAL_INDEX_META = "meta.json"
+
+
+def local_index_dir(codebase_dir: str, project_id: str) -> str:
+    """Local vector index of a project, next to its codebase/{project_id} checkout."""
+    return os.path.join(codebase_dir, f"{project_id}.vectors")
+
+
+def _version_dir(base_dir: str, version) -> str:
+    if isinstance(version, bytes):
+        version = version.decode()
+    return os.path.join(base_dir, hashlib.blake2b(str(version).encode("utf-8"), digest_size=8).hexdigest())
+
+
+def _dense_vector(vector):
+    # Collections created by QdrantVectorStore use a named "text-dense" vector, older ones an unnamed one
+    if isinstance(vector, dict):
+        return vector.get("text-dense") or next(iter(vector.values()))
+    return vector
+
+
+def export_local_index(client, collection_name: str, base_dir: str, version, batch_size: int = 1024) -> int:
+    """
+        Copies every point of a Qdrant collection into a memory-mapped index for `version`:
+        vectors.f32 holds the L2 normalized vectors, payloads.bin the JSON payloads and offsets.i64
+        where each one starts. Older versions are removed once the new one is complete, processes
+        still reading them keep their mappings. Returns the number of points exported.
+    """
+    version_dir = _version_dir(base_dir, version)
+    tmp_dir = f"{version_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    count, dim, offset = 0, None, None
+    offsets = [0]
+    with open(os.path.join(tmp_dir, "vectors.f32"), "wb") as vectors_file, open(os.path.join(tmp_dir, "payloads.bin"), "wb") as payloads_file:
+        while True:
+            points, offset = client.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            if points:
+                vectors = np.asarray([_dense_vector(point.vector) for point in points], dtype=np.float32)
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                dim = vectors.shape[1]
+                vectors_file.write(vectors.tobytes())
+                for point in points:
+                    offsets.append(offsets[-1] + payloads_file.write(json.dumps(point.payload).encode("utf-8")))
+                count += len(points)
+            if offset is None:
+                break
+    np.asarray(offsets, dtype=np.int64).tofile(os.path.join(tmp_dir, "offsets.i64"))
+    with open(os.path.join(tmp_dir, LOCAL_INDEX_META), "w", encoding="utf-8") as f:
+        json.dump({"version": version.decode() if isinstance(version, bytes) else str(version), "count": count, "dim": dim or 0, "created": time.time()}, f)
+
+    shutil.rmtree(version_dir, ignore_errors=True)
+    os.replace(tmp_dir, version_dir)
+    for name in os.listdir(base_dir):
+        path = os.path.join(base_dir, name)
+        if path != version_dir:
+            shutil.rmtree(path, ignore_errors=True)
+    return count
+
+
+def remove_local_index(base_dir: str):
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+
+class LocalVectorIndex:
+    """
+        Read only, memory-mapped view of an exported index with exact cosine search.
+        The arrays are mapped, not read, so the pages are loaded on first use and shared
+        through the page cache by every process that opens the same version.
+    """
+
+    def __init__(self, version_dir: str):
+        with open(os.path.join(version_dir, LOCAL_INDEX_META), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.count = self.meta["count"]
+        self.dim = self.meta["dim"]
+        self.offsets = np.fromfile(os.path.join(version_dir, "offsets.i64"), dtype=np.int64)
+        if self.count:
+            self.vectors = np.memmap(os.path.join(version_dir, "vectors.f32"), dtype=np.float32, mode="r", shape=(self.count, self.dim))
+            with open(os.path.join(version_dir, "payloads.bin"), "rb") as f:
+                self.payloads = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self.payloads = b""
+
+    @classmethod
+    def open(cls, base_dir: str, version):
+        """The index exported for `version`, None when there is none (the caller falls back to Qdrant)."""
+        version_dir = _version_dir(base_dir, version)
+        if not os.path.exists(os.path.join(version_dir, LOCAL_INDEX_META)):
+            return None
+        return cls(version_dir)
+
+    def search(self, query, k: int):
+        """Indices and cosine scores of the k nearest vectors, best first."""
+        if not self.count or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self.vectors @ query
+        k = min(k, self.count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def payload(self, i: int) -> dict:
+        return json.loads(self.payloads[self.offsets[i]:self.offsets[i + 1]])
+
+
+class LocalVectorStore(BasePydanticVectorStore):
+    """llama_index vector store over a LocalVectorIndex, for query engines only."""
+
+    stores_text: bool = True
+    is_embedding_query: bool = True
+
+    _index: LocalVectorIndex = PrivateAttr()
+
+    def __init__(self, index: LocalVectorIndex, **kwargs):
+        super().__init__(**kwargs)
+        self._index = index
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return self._index
+
+    def add(self, nodes: List[Any], **kwargs) -> List[str]:
+        raise NotImplementedError("LocalVectorStore is read only, the indexer exports it from Qdrant")
+
+    def delete(self, ref_doc_id: str, **delete_kwargs) -> None:
+        raise NotImplementedError("LocalVectorStore is read only, the indexer exports it from Qdrant")
+
+    def query(self, query: VectorStoreQuery, **kwargs) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT or query.filters is not None:
+            raise NotImplementedError("LocalVectorStore only supports plain dense queries")
+        top, scores = self._index.search(query.query_embedding, query.similarity_top_k)
+        nodes = [metadata_dict_to_node(self._index.payload(int(i))) for i in top]
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=[float(s) for s in scores],
+            ids=[node.node_id for node in nodes],
+        )
@@ -0,0 +1,30 @@
+from qdrant_client.http import models as rest
+
+# "none" keeps float32 vectors in RAM, "scalar" keeps int8 copies in RAM, "binary" keeps 1 bit per dimension in RAM.
+# Quantized collections store the float32 originals on disk, they are only read to rescore candidates.
+VECTOR_QUANTIZATIONS = ("none", "scalar", "binary")
+
+
+def quantized_collection_config(quantization: str, dim: int):
+    """dense_config and quantization_config for QdrantVectorStore, used when it creates a collection."""
+    if quantization not in VECTOR_QUANTIZATIONS:
+        raise ValueError(f"Unknown vector quantization {quantization!r}, expected one of {', '.join(VECTOR_QUANTIZATIONS)}")
+    if quantization == "none":
+        return rest.VectorParams(size=dim, distance=rest.Distance.COSINE), None
+
+    dense_config = rest.VectorParams(size=dim, distance=rest.Distance.COSINE, on_disk=True)
+    if quantization == "scalar":
+        quantization_config = rest.ScalarQuantization(
+            scalar=rest.ScalarQuantizationConfig(type=rest.ScalarType.INT8, quantile=0.99, always_ram=True),
+        )
+    else:
+        quantization_config = rest.BinaryQuantization(binary=rest.BinaryQuantizationConfig(always_ram=True))
+    return dense_config, quantization_config
+
+
+def quantized_search_params(oversampling: float = 2.0, rescore: bool = True):
+    """
+        Search params for quantized collections: fetch oversampling * k candidates with the quantized
+        vectors, then rescore them with the originals. Qdrant ignores them on collections without quantization.
+    """
+    return rest.SearchParams(quantization=rest.QuantizationSearchParams(rescore=rescore, oversampling=oversampling))
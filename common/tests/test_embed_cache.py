@@ -0,0 +1,114 @@
+"""
+Checks of the on-disk embedding cache.
+
+    cd common && python -m pytest -q tests
+"""
+import pytest
+
+from codevec_common.embed_cache import EmbeddingCache, EmbeddingCacheBusy, open_embedding_cache
+
+DIM = 4
+
+
+def vector(n):
+    return [float(n), n + 0.5, n + 0.25, -float(n)]
+
+
+def open_cache(tmp_path, capacity=8):
+    # One float32 vector takes DIM * 4 bytes, max_bytes sets the number of slots
+    return EmbeddingCache(str(tmp_path), "test/model", max_bytes=capacity * DIM * 4, flush_interval=0)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = open_cache(tmp_path)
+    yield cache
+    cache.close()
+
+
+def test_put_then_get(cache):
+    keys = [cache.key("text", "a"), cache.key("text", "b")]
+    cache.put_many(keys, [vector(1), vector(2)])
+
+    assert cache.get_many(keys + [cache.key("query", "a")]) == [vector(1), vector(2), None]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_crc_mismatch_is_a_miss(cache):
+    key = cache.key("text", "a")
+    cache.put_many([key], [vector(1)])
+    slot = cache.entries[key]
+    # A torn write: the vector changed but its row did not
+    cache.vectors[slot][0] = 42.0
+
+    assert cache.get_many([key]) == [None]
+    assert cache.stats()["invalid"] == 1
+    assert key not in cache.entries
+    assert slot in cache.free
+
+
+def test_slot_of_another_key_is_a_miss(cache):
+    a, b = cache.key("text", "a"), cache.key("text", "b")
+    cache.put_many([a, b], [vector(1), vector(2)])
+    cache.entries[a] = cache.entries[b]
+
+    assert cache.get_many([a]) == [None]
+    assert cache.stats()["invalid"] == 1
+
+
+def test_least_recently_used_is_evicted_first(tmp_path):
+    cache = open_cache(tmp_path, capacity=3)
+    a, b, c, d, e = (cache.key("text", t) for t in "abcde")
+    cache.put_many([a, b, c], [vector(1), vector(2), vector(3)])
+    cache.get_many([a])
+
+    cache.put_many([d], [vector(4)])
+    assert cache.get_many([b]) == [None]
+    cache.put_many([e], [vector(5)])
+    assert cache.get_many([c]) == [None]
+
+    assert cache.get_many([a, d, e]) == [vector(1), vector(4), vector(5)]
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["entries"] == 3
+    cache.close()
+
+
+def test_reopen_after_flush_keeps_vectors_and_their_order(tmp_path):
+    cache = open_cache(tmp_path, capacity=3)
+    a, b, c, d = (cache.key("text", t) for t in "abcd")
+    cache.put_many([a, b, c], [vector(1), vector(2), vector(3)])
+    cache.get_many([a])
+    cache.flush()
+    cache.close()
+
+    reopened = open_cache(tmp_path, capacity=3)
+    assert reopened.stats()["entries"] == 3
+    # b was the least recently used before the reopen, so it goes first
+    reopened.put_many([d], [vector(4)])
+    assert reopened.get_many([a, b, c, d]) == [vector(1), None, vector(3), vector(4)]
+    reopened.close()
+
+
+def test_a_directory_has_one_writer(tmp_path):
+    cache = open_cache(tmp_path)
+    with pytest.raises(EmbeddingCacheBusy):
+        open_cache(tmp_path)
+
+    shard = open_embedding_cache(str(tmp_path), "test/model", max_bytes=8 * DIM * 4, shards=2)
+    assert shard is not None and shard.dir.endswith(".1")
+    assert open_embedding_cache(str(tmp_path), "test/model", shards=2) is None
+
+    shard.close()
+    cache.close()
+    open_cache(tmp_path).close()
+
+
+def test_closed_cache_does_not_write(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.close()
+    cache.put_many([cache.key("text", "a")], [vector(1)])
+
+    reopened = open_cache(tmp_path)
+    assert reopened.stats()["entries"] == 0
+    reopened.close()
@@ -1,7 +1,7 @@
 import multiprocessing as mp
 mp.set_start_method('spawn', force=True)
 
-from tasks.worker import app
+from tasks.worker import app, WORKER_POOL, WORKER_CONCURRENCY
 
 if __name__ == '__main__':
-    app.worker_main(argv=['worker', '--loglevel=info', '--concurrency=1'])
+    app.worker_main(argv=['worker', '--loglevel=info', f'--pool={WORKER_POOL}', f'--concurrency={WORKER_CONCURRENCY}'])
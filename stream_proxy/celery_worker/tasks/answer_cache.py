@@ -0,0 +1,90 @@
+import base64
+import json
+import time
+
+import numpy as np
+
+ANSWER_CACHE_STATS_KEY = "stats:answer-cache"
+
+
+def _encode(vector) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+class AnswerCache:
+    """
+        Per project cache of generated answers, matched on query embedding similarity.
+        Entries live in a capped Redis list per (project, index version), so a re-index
+        starts from an empty cache and old lists simply expire.
+    """
+
+    def __init__(self, redis_client, threshold: float = 0.95, ttl: int = 24 * 3600, max_entries: int = 128):
+        self.redis = redis_client
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _key(self, project_id: str, version) -> str:
+        if isinstance(version, bytes):
+            version = version.decode()
+        return f"answers:{project_id}:{version or 0}"
+
+    def lookup(self, project_id: str, version, embedding):
+        """Return the best cached entry above the similarity threshold, or None."""
+        entries = self.redis.lrange(self._key(project_id, version), 0, -1)
+        if not entries:
+            self.redis.hincrby(ANSWER_CACHE_STATS_KEY, "misses", 1)
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        now = time.time()
+        best, best_score = None, self.threshold
+        for raw in entries:
+            entry = json.loads(raw)
+            if now - entry["created"] > self.ttl:
+                continue
+            vector = _decode(entry["embedding"])
+            score = float(np.dot(query, vector) / (np.linalg.norm(vector) or 1.0))
+            if score >= best_score:
+                best, best_score = entry, score
+
+        if best is None:
+            self.redis.hincrby(ANSWER_CACHE_STATS_KEY, "misses", 1)
+            return None
+        pipe = self.redis.pipeline()
+        pipe.hincrby(ANSWER_CACHE_STATS_KEY, "hits", 1)
+        pipe.hincrbyfloat(ANSWER_CACHE_STATS_KEY, "llm_seconds_saved", best["llm_seconds"])
+        pipe.execute()
+        best["score"] = best_score
+        return best
+
+    def store(self, project_id: str, version, query: str, embedding, answer: str, llm_seconds: float):
+        key = self._key(project_id, version)
+        entry = json.dumps({
+            "query": query,
+            "embedding": _encode(embedding),
+            "answer": answer,
+            "llm_seconds": llm_seconds,
+            "created": time.time(),
+        })
+        pipe = self.redis.pipeline()
+        pipe.lpush(key, entry)
+        pipe.ltrim(key, 0, self.max_entries - 1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def stats(self) -> dict:
+        raw = self.redis.hgetall(ANSWER_CACHE_STATS_KEY)
+        stats = {k.decode() if isinstance(k, bytes) else k: float(v) for k, v in raw.items()}
+        hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+        return {
+            "hits": int(hits),
+            "misses": int(misses),
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "llm_seconds_saved": round(stats.get("llm_seconds_saved", 0.0), 3),
+        }
@@ -0,0 +1,68 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class QueryEmbeddingBatcher:
+    """
+        Micro-batches query embeddings from tasks running concurrently in one worker process.
+        embed() blocks its caller; a single thread takes the first waiting query, collects whatever
+        else arrives within window_ms (up to max_batch) and embeds them in one forward pass.
+        The model is therefore only ever called from that thread.
+    """
+
+    def __init__(self, embed_batch, window_ms: float = 5, max_batch: int = 32):
+        self.embed_batch = embed_batch
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.largest = 0
+        self.thread = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+        self.thread.start()
+
+    def embed(self, query: str, timeout: float = None):
+        future = Future()
+        self.queue.put((query, future))
+        return future.result(timeout)
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # The same question asked twice in one window is embedded once
+            unique = list(dict.fromkeys(query for query, _ in batch))
+            try:
+                vectors = dict(zip(unique, self.embed_batch(unique)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for query, future in batch:
+                future.set_result(vectors[query])
+            with self.lock:
+                self.batches += 1
+                self.queries += len(batch)
+                self.largest = max(self.largest, len(batch))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "largest_batch": self.largest,
+                "mean_batch": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            }
@@ -0,0 +1,43 @@
+import time
+
+from codevec_common.keys import cancel_key, viewers_key
+
+CANCEL_STATS_KEY = "stats:cancellations"
+
+
+class CancellationWatch:
+    """
+        Checks whether every client of a task went away.
+        Redis is polled at most every `interval` seconds, and a disconnect only counts
+        after `grace` seconds without a viewer so a resuming client does not kill its answer.
+    """
+
+    def __init__(self, redis_client, task_id: str, interval: float = 0.5, grace: float = 2.0):
+        self.redis = redis_client
+        self.task_id = task_id
+        self.interval = interval
+        self.grace = grace
+        self.last_check = 0.0
+
+    def cancelled_at(self):
+        """Return the time the last viewer left if the task should stop, None otherwise."""
+        now = time.time()
+        if now - self.last_check < self.interval:
+            return None
+        self.last_check = now
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(cancel_key(self.task_id))
+        pipe.get(viewers_key(self.task_id))
+        cancelled, viewers = pipe.execute()
+        if cancelled is None or (viewers is not None and int(viewers) > 0):
+            return None
+        cancelled = float(cancelled)
+        if now - cancelled < self.grace:
+            return None
+        return cancelled
+
+    def record(self, wasted_tokens: int):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(CANCEL_STATS_KEY, "cancelled", 1)
+        pipe.hincrby(CANCEL_STATS_KEY, "wasted_tokens", wasted_tokens)
+        pipe.execute()
@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+
+class QueryEngineCache:
+    """
+        Bounded LRU of ready to use query engines keyed by project id.
+        Each entry remembers the index version it was built for and is rebuilt once the version changes.
+        build(project_id, version) may return anything, it is handed back as is.
+    """
+
+    def __init__(self, build, max_size: int = 32):
+        self.build = build
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, project_id: str, version=None):
+        with self.lock:
+            entry = self.entries.get(project_id)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(project_id)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self.invalidations += 1
+            self.misses += 1
+
+        engine = self.build(project_id, version)
+
+        with self.lock:
+            self.entries[project_id] = (version, engine)
+            self.entries.move_to_end(project_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return engine
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,165 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+
+from codevec_common.keys import task_stream_key
+
+
+class FlushScheduler:
+    """
+        One daemon thread that flushes the coalescing buffers of every TaskStream in the process
+        once their flush_ms elapsed, so a stalled model does not hold back buffered tokens.
+        Entries made stale by an earlier flush are skipped when they come due.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.due = []
+        self.order = itertools.count()
+        self.thread = None
+
+    def schedule(self, deadline: float, stream):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="stream-flush", daemon=True)
+                self.thread.start()
+            heapq.heappush(self.due, (deadline, next(self.order), stream))
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.due:
+                    self.cond.wait()
+                deadline, _, stream = self.due[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                heapq.heappop(self.due)
+            try:
+                stream.flush_due(deadline)
+            except Exception as e:
+                print(f"Failed to flush {stream.key}: {e}")
+
+
+flush_scheduler = FlushScheduler()
+
+
+class TaskStream:
+    """
+        Writes the messages of one task to its own capped Redis Stream.
+        Entry ids are 0-<seq>, so a client that saw message seq can resume right after it.
+
+        Chunks are coalesced: they are buffered and written as one message every flush_ms
+        or once flush_bytes are pending, whichever comes first. The first chunk and any
+        non-chunk message (complete, error) flush immediately. flush_ms = 0 writes every chunk.
+        The flush_ms bound is kept by the process wide flush_scheduler, not a timer per window.
+
+        Every message carries the request's trace_id, and entries record their publish time
+        in a `ts` field so the streamer can measure delivery latency without parsing payloads.
+    """
+
+    def __init__(self, redis_client, task_id: str, maxlen: int = 10000, ttl: int = 900, flush_ms: int = 50, flush_bytes: int = 512, trace_id: str = None):
+        self.redis = redis_client
+        self.trace_id = trace_id
+        self.key = task_stream_key(task_id)
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.flush_ms = flush_ms
+        self.flush_bytes = flush_bytes
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.deadline = None
+        self.first_chunk_sent = False
+        self.tokens = 0
+        self.publishes = 0
+        self.chunk_publishes = 0
+        self.buffer_delay_total = 0.0
+        self.buffer_delay_max = 0.0
+
+    def send(self, step: str, data, **extra):
+        with self.lock:
+            if step == "chunk":
+                self.tokens += 1
+                if self.flush_ms > 0:
+                    self._buffer(data)
+                    return
+            self._flush_locked()
+            self._write(step, data, **extra)
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def flush_due(self, deadline: float):
+        with self.lock:
+            if self.deadline == deadline:
+                self._flush_locked()
+
+    def _buffer(self, data: str):
+        now = time.time()
+        self.buffer.append((now, data))
+        self.buffer_bytes += len(data.encode("utf-8"))
+        if (
+            not self.first_chunk_sent
+            or self.buffer_bytes >= self.flush_bytes
+            or (now - self.buffer[0][0]) * 1000 >= self.flush_ms
+        ):
+            self._flush_locked()
+        elif self.deadline is None:
+            # Bound the delay even if the model stalls before the next token
+            self.deadline = time.monotonic() + self.flush_ms / 1000
+            flush_scheduler.schedule(self.deadline, self)
+
+    def _flush_locked(self):
+        self.deadline = None
+        if not self.buffer:
+            return
+        now = time.time()
+        for token_ts, _ in self.buffer:
+            delay = now - token_ts
+            self.buffer_delay_total += delay
+            self.buffer_delay_max = max(self.buffer_delay_max, delay)
+        first_ts = self.buffer[0][0]
+        count = len(self.buffer)
+        data = "".join(chunk for _, chunk in self.buffer)
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.first_chunk_sent = True
+        self._write("chunk", data, token_ts=first_ts, tokens=count)
+
+    def _write(self, step: str, data, **extra):
+        self.seq += 1
+        self.publishes += 1
+        if step == "chunk":
+            self.chunk_publishes += 1
+        now = time.time()
+        message = {
+            'step': step,
+            'seq': self.seq,
+            'timestamp': now,
+            'data': data,
+            **extra
+        }
+        if self.trace_id:
+            message['trace_id'] = self.trace_id
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xadd(self.key, {'step': step, 'd': json.dumps(message), 'ts': now}, id=f"0-{self.seq}", maxlen=self.maxlen, approximate=True)
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "tokens": self.tokens,
+                "publishes": self.publishes,
+                "chunk_publishes": self.chunk_publishes,
+                "tokens_per_publish": round(self.tokens / self.chunk_publishes, 2) if self.chunk_publishes else 0.0,
+                "avg_buffer_ms": round(self.buffer_delay_total / self.tokens * 1000, 2) if self.tokens else 0.0,
+                "max_buffer_ms": round(self.buffer_delay_max * 1000, 2),
+            }
@@ -1,20 +1,35 @@
 from celery import Celery
-from celery.signals import worker_process_init
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown
+from celery.exceptions import Ignore
+import re
+import json
 import time
+import socket
 import redis
-import json
 import qdrant_client
 import os
 from llama_index.core import VectorStoreIndex, StorageContext, Settings
 from llama_index.vector_stores.qdrant import QdrantVectorStore
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.prompts import RichPromptTemplate
+from llama_index.core.schema import QueryBundle
 from llama_index.llms.ollama import Ollama
 from dotenv import load_dotenv
+from codevec_common.embed_cache import CachedEmbedding, open_embedding_cache
+from codevec_common.embed_engine import build_embedding, embedding_cache_name
+from codevec_common.keys import QUERY_EMBED_CACHE_STATS_KEY, index_version_key
+from codevec_common.metrics import Histogram, RATE_BUCKETS
+from codevec_common.vector_index import LocalVectorIndex, LocalVectorStore, local_index_dir
+from codevec_common.vector_quantization import quantized_search_params
+from .engine_cache import QueryEngineCache
+from .answer_cache import AnswerCache
+from .stream import TaskStream
+from .cancel import CancellationWatch
+from .batcher import QueryEmbeddingBatcher
 load_dotenv()
 
 llm = None
 embed_model = None
+query_batcher = None
 
 QDRANT_URL = os.getenv("QDRANT_URL", "")
 QDRANT_API = os.getenv("QDRANT_API", "")
@@ -24,9 +39,42 @@ REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 MODEL_NAME = os.getenv("MODEL_NAME", "llama3.1:8b")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# Embedding runtime, see embed_engine.build_embedding
+EMBEDDING_ENGINE = os.getenv("EMBEDDING_ENGINE", "huggingface")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "8192"))
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "cache/onnx")
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "avx2")
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "cache/embeddings")
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "128"))
+ENGINE_CACHE_SIZE = int(os.getenv("ENGINE_CACHE_SIZE", "32"))
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "128"))
+STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", "10000"))
+STREAM_TTL = int(os.getenv("STREAM_TTL", "900"))
+STREAM_FLUSH_MS = int(os.getenv("STREAM_FLUSH_MS", "50"))
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "512"))
+CANCEL_CHECK_INTERVAL = float(os.getenv("CANCEL_CHECK_INTERVAL", "0.5"))
+CANCEL_GRACE = float(os.getenv("CANCEL_GRACE", "2.0"))
+# Small projects are searched in the local index the indexer exports next to their checkout
+CODEBASE_DIR = os.getenv("CODEBASE_DIR", "codebase")
+LOCAL_INDEX_ENABLED = os.getenv("LOCAL_INDEX_ENABLED", "true").lower() == "true"
+# Quantized collections: candidates fetched per result with the quantized vectors, then rescored with the originals
+QUERY_OVERSAMPLING = float(os.getenv("QUERY_OVERSAMPLING", "2.0"))
+QUERY_RESCORE = os.getenv("QUERY_RESCORE", "true").lower() == "true"
+# "threads" runs WORKER_CONCURRENCY generations in one process sharing one embedder, "prefork" is one process per task
+WORKER_POOL = os.getenv("WORKER_POOL", "threads")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "8"))
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+# How long Ollama keeps the model loaded after a request, -1 keeps it resident
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "-1")
 
 # Redis and Qdrant can be shared
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0,  password="satlokashramai")
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, password=REDIS_PASSWORD)
 qdrant = qdrant_client.QdrantClient(
     url=QDRANT_URL,
     port=443,
@@ -87,69 +135,257 @@ app = Celery(
     backend= f'redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0'
 )
 
-@worker_process_init.connect
-def init_worker(**kwargs):
+def build_query_engine(project_id, version=None):
+    """
+    Query engine of a project and the vector backend it searches, "local" when the indexer
+    exported a local index for this index version, "qdrant" otherwise
+    """
+    local_index = LocalVectorIndex.open(local_index_dir(CODEBASE_DIR, project_id), version) if LOCAL_INDEX_ENABLED and version else None
+    if local_index is not None:
+        vector_store, backend, vector_store_kwargs = LocalVectorStore(local_index), "local", {}
+    else:
+        vector_store, backend = QdrantVectorStore(client=qdrant, collection_name=project_id), "qdrant"
+        vector_store_kwargs = {"search_params": quantized_search_params(QUERY_OVERSAMPLING, QUERY_RESCORE)}
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    index = VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
+    query_engine = index.as_query_engine(llm=llm, similarity_top_k=5, streaming=True, vector_store_kwargs=vector_store_kwargs)
+    query_engine.update_prompts(
+        {
+            "response_synthesizer:text_qa_template": text_qa_template,
+            "response_synthesizer:refine_template": refine_template,
+        }
+    )
+    return query_engine, backend
+
+# Kept in Redis so every worker process adds up, exported by the backend's /metrics
+queue_wait_seconds = Histogram("codevec_task_queue_wait_seconds", "Time between /v1/query enqueueing a task and a worker starting it", redis_client=redis_client)
+retrieval_seconds = Histogram("codevec_retrieval_seconds", "Query embedding plus vector search time, by vector backend", redis_client=redis_client)
+vector_search_seconds = Histogram("codevec_vector_search_seconds", "Vector search time alone, by vector backend (local or qdrant)", redis_client=redis_client)
+prompt_seconds = Histogram("codevec_prompt_seconds", "Prompt assembly time before the LLM is called", redis_client=redis_client)
+ttft_seconds = Histogram("codevec_ttft_seconds", "Time from starting the LLM stream to its first token", redis_client=redis_client)
+tokens_per_second = Histogram("codevec_generation_tokens_per_second", "LLM generation rate after the first token", buckets=RATE_BUCKETS, redis_client=redis_client)
+task_seconds = Histogram("codevec_task_duration_seconds", "Task run time by outcome", redis_client=redis_client)
+
+engine_cache = QueryEngineCache(build_query_engine, max_size=ENGINE_CACHE_SIZE)
+answer_cache = AnswerCache(
+    redis_client,
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl=ANSWER_CACHE_TTL,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+)
+
+def keep_alive_value():
+    try:
+        return int(OLLAMA_KEEP_ALIVE)
+    except ValueError:
+        return OLLAMA_KEEP_ALIVE
+
+def init_worker():
     """
-    Initializes LLM and embedding model in each worker process (spawn-safe)
+    Initializes LLM and embedding model once per process and warms both,
+    so the first task does not pay for loading them
     """
-    global llm, embed_model
+    global llm, embed_model, query_batcher
+    if embed_model is not None:
+        return
 
-    # Load Ollama and HF embeddings safely per worker process
-    llm = Ollama(base_url=OLLAMA_HOST, model=MODEL_NAME, request_timeout=60.0)
-    embed_model = HuggingFaceEmbedding(model_name=EMBEDDING_MODEL)
+    engine_model = build_embedding(
+        EMBEDDING_ENGINE,
+        EMBEDDING_MODEL,
+        threads=EMBEDDING_THREADS,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        batch_tokens=EMBEDDING_BATCH_TOKENS,
+        onnx_dir=EMBEDDING_ONNX_DIR,
+        quantization=EMBEDDING_QUANTIZATION,
+    )
+    engine_model.get_query_embedding("warm up")
+    # A cache directory has one writer, so every prefork child opens its own shard
+    embedding_cache = open_embedding_cache(
+        EMBED_CACHE_DIR,
+        embedding_cache_name(EMBEDDING_ENGINE, EMBEDDING_MODEL),
+        max_bytes=EMBED_CACHE_MAX_MB * 1024 * 1024,
+        shards=WORKER_CONCURRENCY if WORKER_POOL == "prefork" else 1,
+    )
+    if embedding_cache is None:
+        print(f"Every embedding cache in {EMBED_CACHE_DIR} is used by another process, embedding without one")
+    embed_model = CachedEmbedding(engine_model, embedding_cache)
     Settings.embed_model = embed_model
 
+    llm = Ollama(base_url=OLLAMA_HOST, model=MODEL_NAME, request_timeout=60.0, keep_alive=keep_alive_value())
+    try:
+        # An empty prompt only loads the model into memory
+        llm.client.generate(model=MODEL_NAME, prompt="", keep_alive=keep_alive_value())
+    except Exception as e:
+        print(f"Failed to warm up {MODEL_NAME} on {OLLAMA_HOST}: {e}")
+
+    if WORKER_POOL != "prefork" and QUERY_BATCH_WINDOW_MS > 0:
+        query_batcher = QueryEmbeddingBatcher(
+            embed_model.get_query_embedding_batch,
+            window_ms=QUERY_BATCH_WINDOW_MS,
+            max_batch=QUERY_BATCH_MAX,
+        )
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    # Prefork children, spawned, so each one loads its own models
+    init_worker()
+
+@worker_init.connect
+def init_worker_threads(**kwargs):
+    # Thread pools run every task in the main process, which never receives worker_process_init
+    if WORKER_POOL != "prefork":
+        init_worker()
+
+def cache_stats_field():
+    # Prefork children have their own cache shard, so each process reports under its own field
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def publish_embedding_cache_stats():
+    """Shares this process's embedding cache stats with /v1/stats/embedding-cache."""
+    if embed_model is None or embed_model.cache is None:
+        return
+    stats = dict(embed_model.cache.stats(), updated_at=time.time())
+    try:
+        redis_client.hset(QUERY_EMBED_CACHE_STATS_KEY, cache_stats_field(), json.dumps(stats))
+    except redis.RedisError as e:
+        print(f"Failed to publish embedding cache stats: {e}")
+
+@worker_process_shutdown.connect
+def forget_worker_process_stats(**kwargs):
+    redis_client.hdel(QUERY_EMBED_CACHE_STATS_KEY, cache_stats_field())
+
+@worker_shutdown.connect
+def forget_worker_stats(**kwargs):
+    if WORKER_POOL != "prefork":
+        redis_client.hdel(QUERY_EMBED_CACHE_STATS_KEY, cache_stats_field())
+
+def embed_query(query):
+    if query_batcher is not None:
+        return query_batcher.embed(query)
+    return embed_model.get_query_embedding(query)
+
 
 @app.task(bind=True, name='process_task')
-def process_task(self, query: str, project_id: str):
+def process_task(self, query: str, project_id: str, inflight_key: str = None, trace_id: str = None, enqueued_at: float = None):
     """
-    Processes a query with streaming updates via Redis Pub/Sub.
+    Processes a query, streaming updates to the task's own Redis Stream (see TaskStream).
+    inflight_key is the single flight marker the backend set for this question, released when the task ends.
+    trace_id is the backend's correlation id, copied into logs and every stream message.
     """
+    task_started = time.perf_counter()
+    if enqueued_at:
+        queue_wait_seconds.observe(max(time.time() - enqueued_at, 0.0))
+    outcome = "error"
 
-    def get_vector_index(project_id):
-        vector_store = QdrantVectorStore(client=qdrant, collection_name=project_id)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
-        return VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
+    stream = TaskStream(
+        redis_client,
+        self.request.id,
+        maxlen=STREAM_MAXLEN,
+        ttl=STREAM_TTL,
+        flush_ms=STREAM_FLUSH_MS,
+        flush_bytes=STREAM_FLUSH_BYTES,
+        trace_id=trace_id,
+    )
 
     def stream_message(step, data):
-        message = {
-            'step': step,
-            'timestamp': time.time(),
-            'data': data
-        }
-        redis_client.publish(f"stream:{project_id}", json.dumps(message))
+        stream.send(step, data)
 
     try:
         stream_message("start", "<start>")
 
-        index = get_vector_index(project_id)
-        query_engine = index.as_query_engine(llm=llm, similarity_top_k=5, streaming=True)
-        
-        query_engine.update_prompts(
-            {
-                "response_synthesizer:text_qa_template": text_qa_template,
-                "response_synthesizer:refine_template": refine_template,
+        retrieval_started = time.perf_counter()
+        version = redis_client.get(index_version_key(project_id))
+        query_embedding = embed_query(query)
+
+        cached = answer_cache.lookup(project_id, version, query_embedding) if ANSWER_CACHE_ENABLED else None
+        if cached is not None:
+            # Replay the stored answer through the same chunk protocol
+            for chunk in re.findall(r"\s*\S+\s*", cached["answer"]):
+                stream_message("chunk", chunk)
+            stream_message("complete", "<stop>")
+            outcome = "cached"
+            return {
+                'query': query,
+                'status': 'completed',
+                'cached': True,
+                'similarity': cached["score"],
+                'finished_at': time.time(),
+                'answer_cache': answer_cache.stats(),
+                'stream': stream.stats()
             }
-        )
-        
-        response = query_engine.query(query)
 
+        # Engines are reused until the indexer bumps the project's index version
+        started = time.perf_counter()
+        query_engine, vector_backend = engine_cache.get(project_id, version)
+        query_bundle = QueryBundle(query_str=query, embedding=query_embedding)
+        with vector_search_seconds.time(backend=vector_backend):
+            nodes = query_engine.retrieve(query_bundle)
+        retrieval_seconds.observe(time.perf_counter() - retrieval_started, backend=vector_backend)
+        with prompt_seconds.time():
+            response = query_engine.synthesize(query_bundle, nodes)
+
+        # Stop generating once every client of this task disconnected
+        watch = CancellationWatch(redis_client, self.request.id, interval=CANCEL_CHECK_INTERVAL, grace=CANCEL_GRACE)
+        cancelled_at = None
+        answer = []
+        token_times = []
+        generation_started = time.time()
         for chunk in response.response_gen:
+            answer.append(chunk)
+            token_times.append(time.time())
             stream_message("chunk", chunk)
+            cancelled_at = watch.cancelled_at()
+            if cancelled_at is not None:
+                break
+
+        if token_times:
+            ttft_seconds.observe(token_times[0] - generation_started)
+        if len(token_times) > 1 and token_times[-1] > token_times[0]:
+            tokens_per_second.observe((len(token_times) - 1) / (token_times[-1] - token_times[0]))
+
+        if cancelled_at is not None:
+            # Closing the generator closes the Ollama HTTP stream, which aborts the generation
+            response.response_gen.close()
+            wasted_tokens = sum(1 for t in token_times if t >= cancelled_at)
+            watch.record(wasted_tokens)
+            stream.send("cancelled", "<stop>", wasted_tokens=wasted_tokens)
+            print(f"[{trace_id}] Task {self.request.id} cancelled, {wasted_tokens} tokens generated without a viewer")
+            outcome = "cancelled"
+            self.update_state(state='CANCELLED', meta={
+                'query': query,
+                'status': 'cancelled',
+                'wasted_tokens': wasted_tokens,
+                'finished_at': time.time(),
+                'stream': stream.stats()
+            })
+            raise Ignore()
 
         stream_message("complete", "<stop>")
+        outcome = "completed"
+
+        if ANSWER_CACHE_ENABLED and answer:
+            answer_cache.store(project_id, version, query, query_embedding, "".join(answer), time.perf_counter() - started)
 
         return {
             'query': query,
             'status': 'completed',
-            'finished_at': time.time()
+            'cached': False,
+            'finished_at': time.time(),
+            'answer_cache': answer_cache.stats(),
+            'embedding_cache': embed_model.cache.stats() if embed_model.cache is not None else None,
+            'engine_cache': engine_cache.stats(),
+            'query_batcher': query_batcher.stats() if query_batcher is not None else None,
+            'stream': stream.stats()
         }
 
+    except Ignore:
+        raise
     except Exception as e:
-        error_msg = {
-            'status': 'error',
-            'message': str(e),
-            'timestamp': time.time()
-        }
-        redis_client.publish(f"stream:{project_id}", json.dumps(error_msg))
+        print(f"[{trace_id}] Task {self.request.id} failed: {e}")
+        stream.send("error", str(e), status='error', message=str(e))
         raise
+    finally:
+        task_seconds.observe(time.perf_counter() - task_started, outcome=outcome)
+        if inflight_key and redis_client.get(inflight_key) == self.request.id.encode():
+            redis_client.delete(inflight_key)
+        publish_embedding_cache_stats()
@@ -0,0 +1,149 @@
+"""
+Retrieval benchmark: the same synthetic project searched through Qdrant and through the local
+memory-mapped index the indexer exports for small projects, with the retriever process_task uses.
+
+Reports p50/p99/mean retrieval latency for both paths at each project size, and how many of
+Qdrant's top-k results the local index returns (it is exact, so this should be 1.0).
+
+    python tests/retrieval_benchmark.py --chunks 1000,5000,20000
+    python tests/retrieval_benchmark.py --qdrant-url https://xyz.cloud.qdrant.io --qdrant-api $QDRANT_API --json
+
+Without --qdrant-url the Qdrant path is qdrant_client's in-process local mode, which has no
+network round trip at all and therefore understates what the remote path costs.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import qdrant_client
+from llama_index.core import MockEmbedding, VectorStoreIndex
+from llama_index.core.schema import QueryBundle, TextNode
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+from codevec_common.vector_index import LocalVectorIndex, LocalVectorStore, export_local_index, local_index_dir
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def make_nodes(count: int, dim: int, rng):
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    nodes = [
+        TextNode(
+            text=f"chunk {i} " + "lorem ipsum " * 60,
+            metadata={"file_path": f"codebase/bench/src/file_{i // 20}.py", "file_name": f"file_{i // 20}.py"},
+            embedding=vectors[i].tolist(),
+        )
+        for i in range(count)
+    ]
+    return nodes, vectors
+
+
+def time_retrievals(retriever, queries):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        nodes = retriever.retrieve(QueryBundle(query_str="benchmark", embedding=query.tolist()))
+        latencies.append(time.perf_counter() - started)
+        results.append([n.node.node_id for n in nodes])
+    return latencies, results
+
+
+def summary(latencies) -> dict:
+    return {
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+    }
+
+
+def benchmark(client, count: int, args, rng) -> dict:
+    collection = f"bench-{uuid.uuid4().hex[:8]}"
+    nodes, vectors = make_nodes(count, args.dim, rng)
+    QdrantVectorStore(client=client, collection_name=collection).add(nodes)
+
+    # Queries near stored chunks, like questions about code that exists
+    picks = rng.integers(0, count, args.queries)
+    queries = vectors[picks] + rng.standard_normal((args.queries, args.dim)).astype(np.float32) * 0.05
+
+    try:
+        with tempfile.TemporaryDirectory() as codebase:
+            base_dir = local_index_dir(codebase, collection)
+            started = time.perf_counter()
+            export_local_index(client, collection, base_dir, "bench")
+            export_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            local_index = LocalVectorIndex.open(base_dir, "bench")
+            open_ms = (time.perf_counter() - started) * 1000
+
+            # Queries carry their embedding, the embed model is never called
+            embed_model = MockEmbedding(embed_dim=args.dim)
+            retrievers = {
+                name: VectorStoreIndex.from_vector_store(store, embed_model=embed_model).as_retriever(similarity_top_k=args.k)
+                for name, store in (
+                    ("qdrant", QdrantVectorStore(client=client, collection_name=collection)),
+                    ("local", LocalVectorStore(local_index)),
+                )
+            }
+            for retriever in retrievers.values():
+                time_retrievals(retriever, queries[:5])
+            qdrant_latencies, qdrant_results = time_retrievals(retrievers["qdrant"], queries)
+            local_latencies, local_results = time_retrievals(retrievers["local"], queries)
+    finally:
+        client.delete_collection(collection)
+
+    overlap = statistics.fmean(len(set(q) & set(l)) / max(len(q), 1) for q, l in zip(qdrant_results, local_results))
+    return {
+        "chunks": count,
+        "export_seconds": round(export_seconds, 3),
+        "local_open_ms": round(open_ms, 3),
+        "local_index_mb": round(vectors.nbytes / 1024 / 1024, 1),
+        "qdrant": summary(qdrant_latencies),
+        "local": summary(local_latencies),
+        f"top{args.k}_agreement": round(overlap, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local index vs Qdrant retrieval benchmark")
+    parser.add_argument("--chunks", default="1000,5000,20000", help="comma separated project sizes")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5, help="similarity_top_k, process_task uses 5")
+    parser.add_argument("--qdrant-url", default="", help="benchmark a real Qdrant instead of the in-process one")
+    parser.add_argument("--qdrant-api", default="")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    if args.qdrant_url:
+        client = qdrant_client.QdrantClient(url=args.qdrant_url, port=443, api_key=args.qdrant_api or None, https=True, prefer_grpc=False)
+    else:
+        client = qdrant_client.QdrantClient(":memory:")
+    rng = np.random.default_rng(args.seed)
+    results = [benchmark(client, int(count), args, rng) for count in args.chunks.split(",")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print(f"\n{result['chunks']} chunks")
+        for key, value in result.items():
+            if key != "chunks":
+                print(f"  {key:20} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,19 +10,23 @@ REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
 
-project_id = input("Enter the project id: ")
+task_id = input("Enter the task id: ")
 console = Console()
 
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, password=REDIS_PASSWORD)
-ps = r.pubsub()
-ps.subscribe(f'stream:{project_id}')
+stream_key = f'stream:task:{task_id}'
+last_id = "0-0"
 
-for msg in ps.listen():
-    if msg['type'] == 'message':
-        try:
-            payload = json.loads(msg['data'])
-            data = payload.get("data")  # Only print the "data" field inside the message
-            console.print(data, end="", highlight=False, soft_wrap=True)
-            sys.stdout.flush()
-        except Exception as e:
-            print("Invalid message:", e)
+while True:
+    for _, entries in r.xread({stream_key: last_id}, block=5000) or []:
+        for entry_id, fields in entries:
+            last_id = entry_id
+            try:
+                payload = json.loads(fields[b'd'])
+                data = payload.get("data")  # Only print the "data" field inside the message
+                console.print(data, end="", highlight=False, soft_wrap=True)
+                sys.stdout.flush()
+            except Exception as e:
+                print("Invalid message:", e)
+            if fields[b'step'] in (b'complete', b'error'):
+                sys.exit(0)
@@ -1,56 +1,121 @@
 import asyncio
 import json
+import time
 from typing import Optional, Dict
 import os
 import redis.asyncio as redis
-import jwt
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, status
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.websockets import WebSocketState
 from dotenv import load_dotenv
 
-load_dotenv()
-
-app = FastAPI()
+from hub import PubSubHub, StreamHub, Outbox, SlowConsumer, coalesce_chunks, outbox_stats
+from codevec_common.auth import VerifiedTokenCache
+from codevec_common.keys import cancel_key, task_stream_key, viewers_key
+from codevec_common.metrics import Histogram, render_value, scrape_authorized
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+load_dotenv()
 
 REDIS_HOST =  os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT =  int(os.getenv("REDIS_PORT", "6379"))
 REDIS_DB =  0
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
 
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
 SUPABASE_JWT_ISSUER = os.getenv("SUPABASE_JWT_ISSUER", "")
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+STREAM_BLOCK_MS = int(os.getenv("STREAM_BLOCK_MS", "100"))
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "300"))
+FINAL_STEPS = {"complete", "error", "cancelled"}
+STREAM_TTL = int(os.getenv("STREAM_TTL", "900"))
 
-active_connections: Dict[str, Dict[WebSocket, asyncio.Task]] = {}
+# Outbound messages buffered per websocket, and what to do with a client that falls behind
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce")
+WS_CLOSE_TRY_AGAIN_LATER = 1013
 
-async def get_redis_client():
-    """Get a Redis client with automatic reconnection."""
-    client = redis.Redis(
+# Bearer token Prometheus sends to /metrics, scraping is refused while it is unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# channel -> {websocket: outbox}, the number of outboxes is the subscription refcount
+active_connections: Dict[str, Dict[WebSocket, Outbox]] = {}
+
+token_cache = VerifiedTokenCache(SUPABASE_JWT_SECRET, issuer=SUPABASE_JWT_ISSUER, max_size=AUTH_CACHE_SIZE)
+
+publish_deliver_seconds = Histogram(
+    "codevec_publish_deliver_seconds",
+    "Time from the worker writing a task stream entry to the streamer handing it to the websocket",
+)
+
+redis_pool: Optional[redis.ConnectionPool] = None
+redis_client: Optional[redis.Redis] = None
+pubsub_hub: Optional[PubSubHub] = None
+stream_hub: Optional[StreamHub] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """One connection pool per process; the hubs multiplex every websocket over it."""
+    global redis_pool, redis_client, pubsub_hub, stream_hub
+    redis_pool = redis.ConnectionPool(
         host=REDIS_HOST,
         port=REDIS_PORT,
         db=REDIS_DB,
         password=REDIS_PASSWORD,
+        max_connections=REDIS_MAX_CONNECTIONS,
         socket_timeout=5,
         socket_keepalive=True,
         health_check_interval=30,
         retry_on_timeout=True,
         decode_responses=True
     )
-    
+    redis_client = redis.Redis(connection_pool=redis_pool)
+    pubsub_hub = PubSubHub(redis_client, active_connections)
+    stream_hub = StreamHub(redis_client, block_ms=STREAM_BLOCK_MS, final_steps=FINAL_STEPS)
     try:
-        await client.ping()
-        return client
-    except Exception as e:
-        print(f"Redis connection error: {e}")
-        raise
+        yield
+    finally:
+        await stream_hub.close()
+        await pubsub_hub.close()
+        await redis_pool.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Prometheus metrics of this streamer process."""
+    if not scrape_authorized(request.headers.get("Authorization"), METRICS_TOKEN):
+        return Response("Invalid metrics token\n", status_code=status.HTTP_403_FORBIDDEN, media_type="text/plain")
+    task_sockets = sum(len(subscribers) for subscribers in stream_hub.subscribers.values())
+    lines = publish_deliver_seconds.render()
+    lines += render_value("codevec_streamer_task_connections", "gauge", "Websockets attached to task streams", task_sockets)
+    lines += render_value("codevec_streamer_task_streams", "gauge", "Task streams read by this process", len(stream_hub.cursors))
+    lines += render_value(
+        "codevec_streamer_channel_connections", "gauge", "Websockets subscribed to pub/sub channels",
+        sum(len(subscribers) for subscribers in active_connections.values()),
+    )
+    lines += render_value(
+        "codevec_streamer_slow_consumer_total", "counter", "Slow consumer policy actions",
+        {(("action", action),): count for action, count in outbox_stats.items()},
+    )
+    auth = token_cache.stats()
+    lines += render_value(
+        "codevec_auth_cache_total", "counter", "Verified token cache lookups by result",
+        {(("result", result),): auth[result] for result in ("hits", "misses", "expired")},
+    )
+    lines += render_value("codevec_auth_cache_evictions_total", "counter", "Verified tokens evicted to stay under AUTH_CACHE_SIZE", auth["evictions"])
+    lines += render_value("codevec_auth_cache_size", "gauge", "Verified tokens currently cached", auth["size"])
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 async def get_token(websocket: WebSocket) -> Optional[Dict]:
     token = websocket.query_params.get("token")
@@ -58,14 +123,8 @@ async def get_token(websocket: WebSocket) -> Optional[Dict]:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return None
     try:
-        # Decode the token
-        payload = jwt.decode(
-            token,
-            SUPABASE_JWT_SECRET,
-            algorithms=["HS256"],
-            options={"verify_aud": False}
-        )
-        return payload
+        # Verified once per token, reconnects with the same token hit the cache
+        return token_cache.verify(token)
     except Exception as e:
         print(f"Auth exception: {e}")
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
@@ -81,31 +140,13 @@ async def websocket_endpoint(websocket: WebSocket, channel: str):
     await websocket.accept()
     print(f"Client connected to channel: {channel}")
     
-    try:
-        redis_client = await get_redis_client()
-    except Exception as e:
-        print(f"Failed to connect to Redis: {e}")
-        await websocket.send_json({
-            "type": "error",
-            "message": "Failed to connect to message server"
-        })
-        await websocket.close(1011)
-        return
-    
-    # Create PubSub object with automatic health check
-    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
-    
-    # Setup connection tracking
-    if channel not in active_connections:
-        active_connections[channel] = {}
-    
-    listener_task = None
+    outbox = Outbox(WS_QUEUE_SIZE, WS_SLOW_CONSUMER_POLICY)
+    sender_task = None
     
     try:
-        # Subscribe to the channel with error handling
+        # Subscribe through the shared subscriber connection
         try:
-            await pubsub.subscribe(channel)
-            print(f"Subscribed to Redis channel: {channel}")
+            await pubsub_hub.subscribe(channel, websocket, outbox)
             
             # Send test message to ensure everything is working
             await redis_client.publish(channel, json.dumps({
@@ -122,11 +163,7 @@ async def websocket_endpoint(websocket: WebSocket, channel: str):
             await websocket.close(1011)
             return
         
-        # Setup listener with reconnection logic
-        listener_task = asyncio.create_task(
-            pubsub_listener(websocket, pubsub, channel, redis_client)
-        )
-        active_connections[channel][websocket] = listener_task
+        sender_task = asyncio.create_task(pubsub_sender(websocket, outbox, channel))
         
         # Main connection loop - handle client messages
         while websocket.client_state == WebSocketState.CONNECTED:
@@ -138,8 +175,6 @@ async def websocket_endpoint(websocket: WebSocket, channel: str):
                     await redis_client.publish(channel, data)
                 except Exception as e:
                     print(f"Failed to publish client message: {e}")
-                    # Try to recreate Redis client if connection failed
-                    redis_client = await get_redis_client()
             except asyncio.TimeoutError:
                 # Just a receive timeout, not an error
                 pass
@@ -151,21 +186,11 @@ async def websocket_endpoint(websocket: WebSocket, channel: str):
         print(f"WebSocket error on channel {channel}: {e}")
     
     finally:
-        # Clean up connections
-        if channel in active_connections and websocket in active_connections[channel]:
-            # Cancel the listener task if it exists
-            if listener_task and not listener_task.done():
-                listener_task.cancel()
-            del active_connections[channel][websocket]
+        if sender_task and not sender_task.done():
+            sender_task.cancel()
         
-        # Unsubscribe and close Redis connection
-        try:
-            await pubsub.unsubscribe(channel)
-            await pubsub.close()
-            await redis_client.close()
-            print(f"Cleaned up Redis connections for channel: {channel}")
-        except Exception as e:
-            print(f"Error closing Redis connections: {e}")
+        # Drop this socket from the channel refcount, the last one unsubscribes
+        await pubsub_hub.unsubscribe(channel, websocket)
         
         # Close WebSocket if still open
         if websocket.client_state == WebSocketState.CONNECTED:
@@ -173,73 +198,124 @@ async def websocket_endpoint(websocket: WebSocket, channel: str):
         
         print(f"Connection to {channel} closed")
 
-async def pubsub_listener(websocket, pubsub, channel, redis_client):
-    """Listen for messages with automatic reconnection."""
-    reconnect_delay = 1.0  # Start with 1 second delay, will increase on failures
-    max_reconnect_delay = 30.0  # Maximum reconnect delay in seconds
-    connection_healthy = True
-    
+async def pubsub_sender(websocket: WebSocket, outbox: Outbox, channel: str):
+    """Push the messages fanned out to this socket, as published."""
     try:
-        print(f"Starting listener for channel: {channel}")
-        
         while websocket.client_state == WebSocketState.CONNECTED:
+            data = await outbox.get()
             try:
-                if not connection_healthy:
-                    # Attempt to reconnect
-                    print(f"Attempting to reconnect to Redis for channel {channel}...")
-                    try:
-                        # Close old connection
-                        await pubsub.close()
-                        
-                        # Create new connection
-                        redis_client = await get_redis_client()
-                        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
-                        await pubsub.subscribe(channel)
-                        
-                        connection_healthy = True
-                        reconnect_delay = 1.0  # Reset delay after successful reconnection
-                        print(f"Successfully reconnected to Redis for channel {channel}")
-                    except Exception as e:
-                        print(f"Failed to reconnect to Redis: {e}")
-                        # Exponential backoff for reconnection attempts
-                        await asyncio.sleep(reconnect_delay)
-                        reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
-                        continue
-                
-                # Get message with short timeout
-                message = await pubsub.get_message(timeout=1.0)
-                
-                if message:
-                    message_type = message.get("type")
-                    
-                    if message_type == "message":
-                        data = message.get("data")
-                        
-                        # Forward message to WebSocket
-                        try:
-                            # Try to parse as JSON, fall back to string if needed
-                            try:
-                                payload = json.loads(data) if isinstance(data, str) else data
-                                await websocket.send_json(payload)
-                            except json.JSONDecodeError:
-                                await websocket.send_text(str(data))
-                        except Exception as e:
-                            print(f"Error sending to WebSocket: {e}")
-                
-                # Prevent CPU spinning
-                await asyncio.sleep(0.01)
-            
-            except redis.ConnectionError as e:
-                print(f"Redis connection error in listener for {channel}: {e}")
-                connection_healthy = False
-                await asyncio.sleep(0.1)  # Small delay before reconnection attempt
-            
+                await websocket.send_text(data)
             except Exception as e:
-                print(f"Error in listener loop for {channel}: {e}")
-                # For non-connection errors, add a small delay
-                await asyncio.sleep(1)
-    
+                print(f"Error sending to WebSocket: {e}")
+    except SlowConsumer:
+        print(f"Client on {channel} fell {WS_QUEUE_SIZE} messages behind, disconnecting")
+        await websocket.close(WS_CLOSE_TRY_AGAIN_LATER)
     except asyncio.CancelledError:
-        print(f"Listener for {channel} was cancelled")
+        print(f"Sender for {channel} was cancelled")
+
+async def attach_viewer(task_id: str):
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.incr(viewers_key(task_id))
+    pipe.expire(viewers_key(task_id), STREAM_TTL)
+    pipe.delete(cancel_key(task_id))
+    await pipe.execute()
+
+async def detach_viewer(task_id: str, finished: bool):
+    """Drop a viewer, and tell the worker to stop generating once the last one left early."""
+    viewers = await redis_client.decr(viewers_key(task_id))
+    if viewers <= 0 and not finished:
+        await redis_client.set(cancel_key(task_id), time.time(), ex=STREAM_TTL)
+        print(f"Last viewer of task {task_id} left, requested cancellation")
+
+@app.websocket("/socket/ws/task/{task_id}")
+async def task_stream_endpoint(websocket: WebSocket, task_id: str):
+    """
+    Relays the Redis Stream of one task. Entries are read from ?last_seq= onwards,
+    so a client can attach after the task started or resume after a dropped connection.
+    """
+    token_data = await get_token(websocket)
+    if token_data is None:
+        return
+
+    await websocket.accept()
+    try:
+        last_seq = max(int(websocket.query_params.get("last_seq", "0")), 0)
+    except ValueError:
+        last_seq = 0
+    print(f"Client attached to task {task_id} after seq {last_seq}")
+
+    try:
+        await attach_viewer(task_id)
+    except Exception as e:
+        print(f"Failed to connect to Redis: {e}")
+        await websocket.send_json({
+            "type": "error",
+            "message": "Failed to connect to message server"
+        })
+        await websocket.close(1011)
+        return
+
+    key = task_stream_key(task_id)
+    outbox = Outbox(WS_QUEUE_SIZE, WS_SLOW_CONSUMER_POLICY, coalesce=coalesce_chunks)
+    sender = asyncio.create_task(stream_sender(websocket, outbox))
+    receiver = asyncio.create_task(drain_client(websocket))
+    try:
+        await stream_hub.subscribe(key, websocket, outbox, last_seq)
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
     except Exception as e:
-        print(f"Fatal error in listener for {channel}: {e}")
\ No newline at end of file
+        print(f"Failed to read the stream of task {task_id}: {e}")
+    finally:
+        stream_hub.unsubscribe(key, websocket)
+        finished = False
+        if sender.done() and not sender.cancelled():
+            if sender.exception():
+                print(f"Stream sender for task {task_id} failed: {sender.exception()}")
+            else:
+                finished = sender.result()
+        for task in (sender, receiver):
+            if not task.done():
+                task.cancel()
+        # Shielded so the viewer count stays right even if this handler is being cancelled
+        await asyncio.shield(release_connection(websocket, task_id, finished))
+
+async def release_connection(websocket: WebSocket, task_id: str, finished: bool):
+    try:
+        await detach_viewer(task_id, finished)
+    except Exception as e:
+        print(f"Failed to detach viewer from task {task_id}: {e}")
+    if websocket.client_state == WebSocketState.CONNECTED:
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+    print(f"Connection to task {task_id} closed")
+
+async def drain_client(websocket: WebSocket):
+    """Consume client frames until it disconnects."""
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+async def stream_sender(websocket: WebSocket, outbox: Outbox):
+    """
+    Push the stream entries the hub queues for this socket until the task reports a final step.
+    Returns True once a final step was sent, False when the stream went idle or the client fell behind.
+    """
+    while True:
+        try:
+            _, step, payload, published_at = await asyncio.wait_for(outbox.get(), timeout=STREAM_IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            print("Task stream idle, closing")
+            return False
+        except SlowConsumer:
+            # The client can resume from its last seq once it reconnects
+            print(f"Client fell {WS_QUEUE_SIZE} messages behind, disconnecting")
+            await websocket.close(WS_CLOSE_TRY_AGAIN_LATER)
+            return False
+        await websocket.send_text(payload)
+        if published_at is not None:
+            publish_deliver_seconds.observe(max(time.time() - published_at, 0.0))
+        if step in FINAL_STEPS:
+            return True
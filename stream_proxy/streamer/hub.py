@@ -0,0 +1,317 @@
+import asyncio
+import json
+from collections import deque
+from typing import Dict
+
+import redis.asyncio as redis
+
+SLOW_CONSUMER_POLICIES = ("coalesce", "drop", "disconnect")
+
+# Process wide counters of what the slow consumer policy had to do
+outbox_stats = {"coalesced": 0, "dropped": 0, "disconnected": 0}
+
+
+class SlowConsumer(Exception):
+    pass
+
+
+class Outbox:
+    """
+    Bounded outbound queue of one websocket, filled by a hub and drained by the socket's sender.
+    When a put finds it full the policy decides: "coalesce" merges runs of queued chunks into
+    one message with their whole text (coalesce_messages for raw pub/sub payloads, unless a
+    coalesce function is given), "drop" discards the oldest message and "disconnect" closes the
+    socket. Whatever coalescing cannot merge is dropped oldest first. Final messages are always
+    accepted so a client that keeps up eventually learns the stream ended.
+    """
+
+    def __init__(self, maxsize: int = 256, policy: str = "coalesce", coalesce=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.coalesce = coalesce or coalesce_messages
+        self.items = deque()
+        self.ready = asyncio.Event()
+        self.overflowed = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item, final: bool = False) -> bool:
+        """Queue an item, returns False once the socket has to be disconnected."""
+        if self.overflowed:
+            return False
+        if len(self.items) >= self.maxsize and not final:
+            if self.policy == "disconnect":
+                self.overflowed = True
+                outbox_stats["disconnected"] += 1
+                self.ready.set()
+                return False
+            if self.policy == "coalesce":
+                before = len(self.items) + 1
+                self.items = deque(self.coalesce(list(self.items) + [item]))
+                outbox_stats["coalesced"] += before - len(self.items)
+                item = None
+            while len(self.items) >= self.maxsize + (item is None):
+                self.items.popleft()
+                outbox_stats["dropped"] += 1
+        if item is not None:
+            self.items.append(item)
+        self.ready.set()
+        return True
+
+    async def get(self):
+        while not self.items:
+            if self.overflowed:
+                raise SlowConsumer()
+            self.ready.clear()
+            await self.ready.wait()
+        if self.overflowed:
+            raise SlowConsumer()
+        return self.items.popleft()
+
+
+def _merge_chunks(payloads) -> str:
+    """One chunk message with the text of all of them and the other fields of the last one."""
+    messages = [json.loads(payload) for payload in payloads]
+    message = dict(messages[-1])
+    message["data"] = "".join(m.get("data", "") for m in messages)
+    message["token_ts"] = messages[0].get("token_ts", messages[0].get("timestamp"))
+    message["tokens"] = sum(m.get("tokens", 1) for m in messages)
+    return json.dumps(message)
+
+
+def _coalesce_runs(items, is_chunk, merge):
+    merged = []
+    run = []
+
+    def flush_run():
+        if len(run) == 1:
+            merged.append(run[0])
+        elif run:
+            merged.append(merge(run))
+        run.clear()
+
+    for item in items:
+        if is_chunk(item):
+            run.append(item)
+        else:
+            flush_run()
+            merged.append(item)
+    flush_run()
+    return merged
+
+
+def coalesce_chunks(items):
+    """
+    Merge runs of queued chunk entries into one message carrying the last seq,
+    so a lagging client receives the same text in fewer frames.
+    """
+    return _coalesce_runs(
+        items,
+        lambda item: item[1] == "chunk",
+        lambda run: (run[-1][0], "chunk", _merge_chunks([payload for _, _, payload, _ in run]), run[0][3]),
+    )
+
+
+def _is_chunk_payload(payload) -> bool:
+    try:
+        message = json.loads(payload)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(message, dict) and message.get("step") == "chunk" and isinstance(message.get("data", ""), str)
+
+
+def coalesce_messages(items):
+    """Like coalesce_chunks, for raw pub/sub payloads: JSON messages with step "chunk" are merged, others kept."""
+    return _coalesce_runs(items, _is_chunk_payload, _merge_chunks)
+
+
+class PubSubHub:
+    """
+    One subscriber connection per process, shared by every local websocket.
+    `connections` maps channel -> {websocket: outbox}: a channel stays subscribed while it
+    has at least one outbox, and every message is pushed, unchanged, to all of them.
+    """
+
+    def __init__(self, redis_client: redis.Redis, connections: Dict[str, Dict]):
+        self.redis = redis_client
+        self.connections = connections
+        self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self.lock = asyncio.Lock()
+        self.reader = None
+
+    async def subscribe(self, channel: str, websocket, outbox: Outbox):
+        async with self.lock:
+            subscribers = self.connections.setdefault(channel, {})
+            subscribers[websocket] = outbox
+            if len(subscribers) == 1:
+                try:
+                    await self.pubsub.subscribe(channel)
+                except Exception:
+                    del self.connections[channel]
+                    raise
+                print(f"Subscribed to Redis channel: {channel}")
+            if self.reader is None or self.reader.done():
+                self.reader = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, channel: str, websocket):
+        async with self.lock:
+            subscribers = self.connections.get(channel)
+            if subscribers is None or subscribers.pop(websocket, None) is None:
+                return
+            if subscribers:
+                return
+            del self.connections[channel]
+            try:
+                await self.pubsub.unsubscribe(channel)
+                print(f"Unsubscribed from Redis channel: {channel}")
+            except Exception as e:
+                print(f"Failed to unsubscribe from channel {channel}: {e}")
+
+    def _fan_out(self, channel: str, data):
+        for outbox in list(self.connections.get(channel, {}).values()):
+            outbox.put(data)
+
+    async def _reconnect(self):
+        async with self.lock:
+            try:
+                await self.pubsub.aclose()
+            except Exception:
+                pass
+            self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            if self.connections:
+                await self.pubsub.subscribe(*self.connections)
+
+    async def _listen(self):
+        """Read the shared subscriber connection while any channel has local viewers."""
+        reconnect_delay = 1.0
+        max_reconnect_delay = 30.0
+        healthy = True
+        while self.connections:
+            try:
+                if not healthy:
+                    print("Attempting to reconnect the Redis subscriber...")
+                    await self._reconnect()
+                    healthy = True
+                    reconnect_delay = 1.0
+                    print(f"Resubscribed to {len(self.connections)} channels")
+
+                # Blocks on the socket until Redis pushes something, no polling
+                message = await self.pubsub.get_message(timeout=None)
+                if message and message.get("type") == "message":
+                    self._fan_out(message["channel"], message["data"])
+
+            except redis.ConnectionError as e:
+                print(f"Redis subscriber connection error: {e}")
+                healthy = False
+                await asyncio.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in Redis subscriber loop: {e}")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            await asyncio.gather(self.reader, return_exceptions=True)
+        await self.pubsub.aclose()
+
+
+def _seq(entry_id: str) -> int:
+    return int(entry_id.split("-", 1)[1])
+
+
+class StreamHub:
+    """
+    Reads the task streams of every local websocket with one multi-key XREAD.
+    A subscriber first gets its backlog straight from XRANGE, without waiting for the blocking
+    XREAD, then the shared reader takes over after the last entry it was sent. Every outbox
+    receives (seq, step, payload, published_at) tuples in order and without duplicates.
+    """
+
+    def __init__(self, redis_client: redis.Redis, block_ms: int = 100, count: int = 100, final_steps=()):
+        self.redis = redis_client
+        self.block_ms = block_ms
+        self.final_steps = set(final_steps)
+        self.count = count
+        self.cursors: Dict[str, str] = {}
+        self.subscribers: Dict[str, Dict] = {}
+        self.wakeup = asyncio.Event()
+        self.reader = None
+
+    async def subscribe(self, key: str, websocket, outbox: Outbox, last_seq: int):
+        while True:
+            for entry_id, fields in await self.redis.xrange(key, min=f"(0-{last_seq}", max="+"):
+                self._put(outbox, entry_id, fields)
+                last_seq = _seq(entry_id)
+            # Read again if the shared reader moved past this position during the replay
+            cursor = self.cursors.get(key)
+            if cursor is None or _seq(cursor) <= last_seq:
+                break
+        if key not in self.cursors:
+            # First local viewer: the next XREAD starts right after its position
+            self.cursors[key] = f"0-{last_seq}"
+        self.subscribers.setdefault(key, {})[websocket] = [outbox, last_seq]
+        self.wakeup.set()
+        if self.reader is None or self.reader.done():
+            self.reader = asyncio.create_task(self._read())
+
+    def unsubscribe(self, key: str, websocket):
+        subscribers = self.subscribers.get(key)
+        if subscribers is None:
+            return
+        subscribers.pop(websocket, None)
+        if not subscribers:
+            del self.subscribers[key]
+            del self.cursors[key]
+
+    def _put(self, outbox: Outbox, entry_id: str, fields: dict):
+        step = fields.get("step")
+        published_at = float(fields["ts"]) if "ts" in fields else None
+        outbox.put((_seq(entry_id), step, fields["d"], published_at), final=step in self.final_steps)
+
+    def _deliver(self, key: str, entry_id: str, fields: dict):
+        seq = _seq(entry_id)
+        for subscriber in self.subscribers.get(key, {}).values():
+            outbox, last_seq = subscriber
+            if seq > last_seq:
+                self._put(outbox, entry_id, fields)
+                subscriber[1] = seq
+
+    async def _read(self):
+        reconnect_delay = 1.0
+        max_reconnect_delay = 30.0
+        while True:
+            try:
+                if not self.cursors:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+
+                response = await self.redis.xread(dict(self.cursors), block=self.block_ms, count=self.count)
+                reconnect_delay = 1.0
+                for key, entries in response or []:
+                    if key not in self.cursors:
+                        continue
+                    for entry_id, fields in entries:
+                        self.cursors[key] = entry_id
+                        self._deliver(key, entry_id, fields)
+
+            except redis.ConnectionError as e:
+                print(f"Redis stream reader connection error: {e}")
+                await asyncio.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in Redis stream reader loop: {e}")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            await asyncio.gather(self.reader, return_exceptions=True)
@@ -0,0 +1,233 @@
+"""
+Load test for the streamer: runs app.py in-process against a local Redis stand-in,
+attaches N authenticated websocket clients spread over M task streams (or pub/sub channels)
+and publishes synthetic tokens at a fixed rate per stream.
+
+Reports publish -> deliver latency (p50/p99/max), delivered messages per second, the CPU
+time of the streamer thread and the RSS growth per connection. The clients run in the same
+process, so the RSS figure is an upper bound for the server side.
+
+    pip install fakeredis
+    python tests/load_test.py --clients 500 --streams 50 --rate 20 --duration 10
+
+Pass --redis-port to benchmark against a real Redis instead of the fakeredis server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+import jwt
+import redis.asyncio as redis
+import uvicorn
+import websockets
+
+BENCH_JWT_SECRET = "load-test-secret-0123456789abcdef0123456789"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_redis(port: int):
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def thread_cpu_seconds(native_id: int) -> float:
+    """utime + stime of one thread of this process."""
+    with open(f"/proc/self/task/{native_id}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class StreamerThread(threading.Thread):
+    """Serves the streamer app with uvicorn on its own event loop."""
+
+    def __init__(self, port: int):
+        super().__init__(daemon=True)
+        import app as streamer
+
+        self.streamer = streamer
+        self.server = uvicorn.Server(uvicorn.Config(streamer.app, host="127.0.0.1", port=port, log_level="warning"))
+
+    def run(self):
+        asyncio.run(self.server.serve())
+
+    def wait_started(self, timeout: float = 10.0):
+        deadline = time.time() + timeout
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError("Streamer did not start")
+            time.sleep(0.05)
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+async def run_client(url: str, latencies: list, counts: list, connected: asyncio.Event, ready: list, total: int):
+    async with websockets.connect(url, max_queue=None) as ws:
+        ready.append(1)
+        if len(ready) == total:
+            connected.set()
+        async for raw in ws:
+            received = time.time()
+            message = json.loads(raw)
+            if "seq" not in message:
+                continue
+            if message.get("step") == "chunk":
+                latencies.append(received - message.get("token_ts", message["timestamp"]))
+                counts.append(message.get("tokens", 1))
+            if message.get("step") == "complete":
+                return
+
+
+async def publish(client, mode: str, target: str, rate: float, duration: float):
+    """Publish tokens to one stream at `rate` per second, then a final complete message."""
+    interval = 1.0 / rate
+    started = time.time()
+    seq = 0
+    while time.time() - started < duration:
+        seq += 1
+        await send(client, mode, target, seq, "chunk", "tok ")
+        await asyncio.sleep(max(0.0, started + seq * interval - time.time()))
+    await send(client, mode, target, seq + 1, "complete", "<stop>")
+    return seq
+
+
+async def send(client, mode: str, target: str, seq: int, step: str, data: str):
+    now = time.time()
+    message = json.dumps({"step": step, "seq": seq, "timestamp": now, "data": data})
+    if mode == "task":
+        await client.xadd(f"stream:task:{target}", {"step": step, "d": message, "ts": now}, id=f"0-{seq}")
+    else:
+        await client.publish(target, message)
+
+
+async def benchmark(args, streamer: StreamerThread, port: int):
+    token = jwt.encode({"sub": "load-test", "exp": int(time.time()) + 3600}, BENCH_JWT_SECRET, algorithm="HS256")
+    targets = [f"bench-{uuid.uuid4().hex[:8]}" for _ in range(args.streams)]
+    path = "socket/ws/task/" if args.mode == "task" else "socket/ws/"
+    client = redis.Redis(host="127.0.0.1", port=args.redis_port, password=args.redis_password, decode_responses=True)
+
+    latencies, counts, ready = [], [], []
+    connected = asyncio.Event()
+    rss_before = rss_bytes()
+    connect_started = time.time()
+    clients = [
+        asyncio.create_task(run_client(
+            f"ws://127.0.0.1:{port}/{path}{targets[i % args.streams]}?token={token}",
+            latencies, counts, connected, ready, args.clients,
+        ))
+        for i in range(args.clients)
+    ]
+    await asyncio.wait_for(connected.wait(), timeout=args.connect_timeout)
+    connect_seconds = time.time() - connect_started
+    # Let the hubs attach every subscriber before the first token
+    await asyncio.sleep(0.5)
+    rss_connected = rss_bytes()
+
+    cpu_before = thread_cpu_seconds(streamer.native_id)
+    started = time.time()
+    published = await asyncio.gather(*(publish(client, args.mode, t, args.rate, args.duration) for t in targets))
+    done, pending = await asyncio.wait(clients, timeout=args.drain_timeout)
+    elapsed = time.time() - started
+    cpu_seconds = thread_cpu_seconds(streamer.native_id) - cpu_before
+    for task in pending:
+        task.cancel()
+    failed = sum(1 for task in done if task.exception())
+    await client.aclose()
+
+    delivered = sum(counts)
+    expected = sum(published) * args.clients // args.streams
+    return {
+        "mode": args.mode,
+        "clients": args.clients,
+        "streams": args.streams,
+        "rate_per_stream": args.rate,
+        "duration": args.duration,
+        "connect_seconds": round(connect_seconds, 3),
+        "tokens_published": sum(published),
+        "tokens_delivered": delivered,
+        "tokens_expected": expected,
+        "frames_delivered": len(latencies),
+        "clients_unfinished": len(pending),
+        "clients_failed": failed,
+        "msgs_per_sec": round(len(latencies) / elapsed, 1),
+        "tokens_per_sec": round(delivered / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "latency_max_ms": round(max(latencies, default=0.0) * 1000, 2),
+        "latency_mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "server_cpu_seconds": round(cpu_seconds, 3),
+        "server_cpu_percent": round(cpu_seconds / elapsed * 100, 1),
+        "server_cpu_ms_per_connection_per_sec": round(cpu_seconds / elapsed / args.clients * 1000, 4),
+        "rss_per_connection_kb": round((rss_connected - rss_before) / args.clients / 1024, 1),
+        "slow_consumer": dict(streamer.streamer.outbox_stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streamer load test")
+    parser.add_argument("--clients", type=int, default=100, help="websocket clients")
+    parser.add_argument("--streams", type=int, default=10, help="task streams (or channels) shared by the clients")
+    parser.add_argument("--rate", type=float, default=20.0, help="tokens per second per stream")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of publishing")
+    parser.add_argument("--mode", choices=("task", "pubsub"), default="task")
+    parser.add_argument("--redis-port", type=int, default=0, help="use a running Redis instead of fakeredis")
+    parser.add_argument("--redis-password", default="")
+    parser.add_argument("--connect-timeout", type=float, default=60.0)
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    if not args.redis_port:
+        args.redis_port = free_port()
+        start_fake_redis(args.redis_port)
+    os.environ.update({
+        "REDIS_HOST": "127.0.0.1",
+        "REDIS_PORT": str(args.redis_port),
+        "REDIS_PASSWORD": args.redis_password,
+        "SUPABASE_JWT_SECRET": BENCH_JWT_SECRET,
+    })
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    port = free_port()
+    streamer = StreamerThread(port)
+    streamer.start()
+    streamer.wait_started()
+    try:
+        result = asyncio.run(benchmark(args, streamer, port))
+    finally:
+        streamer.server.should_exit = True
+        streamer.join(timeout=10)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:40} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Checks of the streamer's outboxes and stream hub, against fakeredis.
+
+    cd stream_proxy/streamer && python -m pytest -q tests
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import fakeredis
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hub import Outbox, SlowConsumer, StreamHub, coalesce_chunks
+
+
+def chunk(text, step="chunk"):
+    return json.dumps({"step": step, "data": text})
+
+
+def drain(outbox):
+    async def run():
+        items = []
+        while len(outbox):
+            items.append(await outbox.get())
+        return items
+    return asyncio.run(run())
+
+
+def test_coalesce_keeps_the_whole_text_of_raw_messages():
+    outbox = Outbox(maxsize=4, policy="coalesce")
+    words = [f"w{i} " for i in range(20)]
+    for word in words:
+        assert outbox.put(chunk(word))
+    outbox.put(chunk("<stop>", step="complete"), final=True)
+
+    messages = [json.loads(item) for item in drain(outbox)]
+    assert len(messages) <= 5
+    assert "".join(m["data"] for m in messages if m["step"] == "chunk") == "".join(words)
+    assert messages[-1]["step"] == "complete"
+
+
+def test_coalesce_only_merges_runs_of_chunks():
+    outbox = Outbox(maxsize=4, policy="coalesce")
+    for message in [chunk("a"), chunk("b"), chunk("sources", step="sources"), chunk("c"), chunk("d")]:
+        assert outbox.put(message)
+
+    messages = [json.loads(item) for item in drain(outbox)]
+    assert [(m["step"], m["data"]) for m in messages] == [("chunk", "ab"), ("sources", "sources"), ("chunk", "cd")]
+
+
+def test_coalesce_chunks_keeps_the_last_seq_and_the_first_publish_time():
+    items = [(seq, "chunk", chunk(f"w{seq} "), 100.0 + seq) for seq in range(1, 4)]
+    items.append((4, "complete", chunk("", step="complete"), 104.0))
+
+    merged = coalesce_chunks(items)
+    assert [(seq, step, published_at) for seq, step, _, published_at in merged] == [(3, "chunk", 101.0), (4, "complete", 104.0)]
+    message = json.loads(merged[0][2])
+    assert message["data"] == "w1 w2 w3 "
+    assert message["tokens"] == 3
+
+
+def test_drop_discards_the_oldest():
+    outbox = Outbox(maxsize=3, policy="drop")
+    for i in range(5):
+        assert outbox.put(chunk(str(i)))
+
+    assert [json.loads(item)["data"] for item in drain(outbox)] == ["2", "3", "4"]
+
+
+def test_disconnect_stops_the_socket():
+    outbox = Outbox(maxsize=2, policy="disconnect")
+    assert outbox.put(chunk("a"))
+    assert outbox.put(chunk("b"))
+    assert not outbox.put(chunk("c"))
+    assert not outbox.put(chunk("<stop>", step="complete"), final=True)
+
+    with pytest.raises(SlowConsumer):
+        drain(outbox)
+
+
+@pytest.mark.parametrize("policy", ["coalesce", "drop"])
+def test_final_messages_are_always_accepted(policy):
+    outbox = Outbox(maxsize=2, policy=policy)
+    outbox.put(chunk("sources", step="sources"))
+    outbox.put(chunk("sources", step="sources"))
+    assert outbox.put(chunk("<stop>", step="complete"), final=True)
+
+    assert json.loads(drain(outbox)[-1])["step"] == "complete"
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        Outbox(policy="block")
+
+
+async def add(client, key, seq, step="chunk"):
+    await client.xadd(key, {"step": step, "d": chunk(f"{seq} ", step=step), "ts": time.time()}, id=f"0-{seq}")
+
+
+async def delivered(outbox, until, timeout=5.0):
+    """Seqs queued in an outbox once it holds `until`, without draining it."""
+    deadline = time.monotonic() + timeout
+    while not any(seq == until for seq, _, _, _ in outbox.items):
+        assert time.monotonic() < deadline, f"seq {until} never arrived"
+        await asyncio.sleep(0.01)
+    return [seq for seq, _, _, _ in outbox.items]
+
+
+def test_backlog_replay_hands_over_to_the_reader_without_gaps_or_duplicates():
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        hub = StreamHub(client, block_ms=50, final_steps=("complete",))
+        key = "stream:task:t"
+        for seq in (1, 2, 3):
+            await add(client, key, seq)
+
+        first = Outbox()
+        await hub.subscribe(key, "first", first, last_seq=1)
+        # The backlog is queued by subscribe itself, before the reader has run
+        assert [seq for seq, _, _, _ in first.items] == [2, 3]
+
+        await add(client, key, 4)
+        # Joins while the shared reader may or may not have read 4 yet
+        second = Outbox()
+        await hub.subscribe(key, "second", second, last_seq=2)
+        await add(client, key, 5)
+        await add(client, key, 6, step="complete")
+
+        try:
+            assert await delivered(first, 6) == [2, 3, 4, 5, 6]
+            assert await delivered(second, 6) == [3, 4, 5, 6]
+        finally:
+            await hub.close()
+
+    asyncio.run(run())
+
+
+def test_subscriber_behind_the_reader_catches_up_from_the_stream():
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        hub = StreamHub(client, block_ms=50, final_steps=("complete",))
+        key = "stream:task:t"
+        for seq in range(1, 6):
+            await add(client, key, seq)
+
+        ahead = Outbox()
+        await hub.subscribe(key, "ahead", ahead, last_seq=5)
+        await add(client, key, 6)
+        assert await delivered(ahead, 6) == [6]
+
+        # The reader's cursor is already at 6, a reconnecting client resumes from 0
+        behind = Outbox()
+        await hub.subscribe(key, "behind", behind, last_seq=0)
+        await add(client, key, 7, step="complete")
+
+        try:
+            assert await delivered(behind, 7) == [1, 2, 3, 4, 5, 6, 7]
+            assert await delivered(ahead, 7) == [6, 7]
+        finally:
+            await hub.close()
+
+    asyncio.run(run())
+
+
+def test_entries_read_by_the_reader_during_a_replay_are_not_skipped():
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        hub = StreamHub(client, block_ms=50, final_steps=("complete",))
+        key = "stream:task:t"
+        for seq in (1, 2, 3):
+            await add(client, key, seq)
+        hub.cursors[key] = "0-3"
+        xrange = client.xrange
+
+        async def xrange_racing_the_reader(*args, **kwargs):
+            entries = await xrange(*args, **kwargs)
+            if hub.cursors[key] == "0-3":
+                # The shared reader reads 4 for the other viewers between this XRANGE and the subscription
+                await add(client, key, 4)
+                hub.cursors[key] = "0-4"
+            return entries
+
+        client.xrange = xrange_racing_the_reader
+        outbox = Outbox()
+        await hub.subscribe(key, "late", outbox, last_seq=0)
+        await add(client, key, 5, step="complete")
+
+        try:
+            assert await delivered(outbox, 5) == [1, 2, 3, 4, 5]
+        finally:
+            await hub.close()
+
+    asyncio.run(run())
@@ -24,6 +24,8 @@ interface Project {
   status: boolean
 }
 
+const MAX_STREAM_RETRIES = 5
+
 function DeployPrompt({ onDeploy }: { onDeploy: () => void }) {
   return (
     <div className="h-full flex flex-col justify-center items-center bg-background px-6">
@@ -125,11 +127,13 @@ const Playground = ({ project_id }: PlaygroundProps) => {
   const [hasInitialized, setHasInitialized] = useState(false)
 
   const socketRef = useRef<WebSocket | null>(null)
+  const lastSeqRef = useRef(0)
+  const streamDoneRef = useRef(false)
   const messageRef = useRef<HTMLDivElement>(null)
   const initializationCompleteRef = useRef(false)
   const { user } = useAuth()
 
-  const wsBaseUrl = `${process.env.NEXT_PUBLIC_SOCKET_PROTOCOL}://${process.env.NEXT_PUBLIC_BACKEND_SOCKET_URI}/${process.env.NEXT_PUBLIC_SOCKET_PATH}/ws/stream`
+  const wsBaseUrl = `${process.env.NEXT_PUBLIC_SOCKET_PROTOCOL}://${process.env.NEXT_PUBLIC_BACKEND_SOCKET_URI}/${process.env.NEXT_PUBLIC_SOCKET_PATH}/ws/task`
   const supabase = createClient()
 
   const fetchProjectDetails = async () => {
@@ -166,14 +170,15 @@ const Playground = ({ project_id }: PlaygroundProps) => {
     setProjectState("initializing")
   }
 
-  const connectWebSocketForStream = async () => {
+  const connectTaskStream = async (taskId: string, attempt = 0) => {
     if (socketRef.current) {
       socketRef.current.close()
     }
 
     const { data } = await supabase.auth.getSession()
     const token = data.session?.access_token
-    const wsUrl = `${wsBaseUrl}:${encodeURIComponent(project_id)}?token=${token}`
+    // last_seq lets the streamer resume right after the last message we rendered
+    const wsUrl = `${wsBaseUrl}/${encodeURIComponent(taskId)}?token=${token}&last_seq=${lastSeqRef.current}`
 
     const socket = new WebSocket(wsUrl)
 
@@ -184,23 +189,23 @@ const Playground = ({ project_id }: PlaygroundProps) => {
     socket.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data)
-        if (data.type === "start") {
-          setCurrentMessage("")
-          setIsStreaming(true)
-        } else if (data.type === "content" && data.content) {
-          setCurrentMessage((prev) => prev + data.content)
-        } else if (data.type === "end") {
-          setIsStreaming(false)
-        } else if (data.step === "chunk" && data.data) {
+        if (typeof data.seq === "number") {
+          if (data.seq <= lastSeqRef.current) return
+          lastSeqRef.current = data.seq
+        }
+        if (data.step === "chunk" && data.data) {
           setCurrentMessage((prev) => prev + data.data)
           setIsStreaming(true)
-        } else if (data.step === "complete") {
+        } else if (data.step === "complete" || data.step === "cancelled") {
+          streamDoneRef.current = true
           setIsStreaming(false)
           socket.close()
           console.log("Socket disconnected")
-        } else if (data.content) {
-          setCurrentMessage((prev) => prev + data.content)
-          setIsStreaming(true)
+        } else if (data.step === "error") {
+          streamDoneRef.current = true
+          setCurrentMessage((prev) => prev || "Sorry, something went wrong while generating the answer.")
+          setIsStreaming(false)
+          socket.close()
         }
       } catch (e) {
         console.error("Failed to parse WS message:", e)
@@ -209,11 +214,15 @@ const Playground = ({ project_id }: PlaygroundProps) => {
 
     socket.onerror = (err) => {
       console.error("WebSocket error:", err)
-      setIsStreaming(false)
     }
 
     socket.onclose = () => {
-      console.warn("WebSocket connection closed")
+      if (socketRef.current !== socket) return
+      if (!streamDoneRef.current && attempt < MAX_STREAM_RETRIES) {
+        console.warn("WebSocket connection dropped, resuming stream")
+        setTimeout(() => connectTaskStream(taskId, attempt + 1), 500 * (attempt + 1))
+        return
+      }
       setIsStreaming(false)
     }
 
@@ -223,28 +232,6 @@ const Playground = ({ project_id }: PlaygroundProps) => {
   const handleQuery = async (query: string) => {
     if (!query.trim()) return
 
-    await connectWebSocketForStream()
-
-    const maxWaitTime = 5000
-    const interval = 100
-    let waited = 0
-
-    while (socketRef.current && socketRef.current.readyState !== WebSocket.OPEN && waited < maxWaitTime) {
-      await new Promise((resolve) => setTimeout(resolve, interval))
-      waited += interval
-    }
-
-    if (!socketRef.current || socketRef.current.readyState !== WebSocket.OPEN) {
-      console.error("WebSocket connection failed to open within timeout.")
-      if (socketRef.current) {
-        socketRef.current.close()
-      }
-      setCurrentMessage("Failed to establish a WebSocket connection in time. Please try again.")
-      setIsStreaming(false)
-      return
-    }
-
-    console.log("WebSocket is now open.")
     setLastUserQuery(query)
     setCurrentMessage("")
     setIsStreaming(true)
@@ -258,6 +245,10 @@ const Playground = ({ project_id }: PlaygroundProps) => {
       if (response.status !== 200) {
         throw new Error(`HTTP error! status: ${response.status}`)
       }
+
+      lastSeqRef.current = 0
+      streamDoneRef.current = false
+      await connectTaskStream(response.data.message)
     } catch (error) {
       console.error("Error sending query:", error)
       setCurrentMessage("Sorry, I couldn't send your query to the server. Please try again.")
@@ -284,6 +275,7 @@ const Playground = ({ project_id }: PlaygroundProps) => {
     fetchProjectDetails()
 
     return () => {
+      streamDoneRef.current = true
       if (socketRef.current) {
         socketRef.current.close()
       }